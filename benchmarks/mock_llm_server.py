@@ -0,0 +1,160 @@
+"""
+本地 OpenAI 兼容替身服务器，用于离线基准测试，不消耗真实 API。
+
+- Chief 的任务分解请求返回 tasks 个子任务的 JSON 列表，Manager 的步骤分解请求返回 steps 个步骤
+  （dag 为 True 时带 depends_on）；
+- 其他请求返回约 output_chars 个字符的填充文本；
+- 每个请求先等待 latency 秒，再按 chars_per_second 的速度输出（支持 stream=True 的 SSE）。
+
+用法: python benchmarks/mock_llm_server.py --port 8765 --latency 0.2
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULTS = {
+    "latency": 0.05,  # 首个 token 之前的延迟（秒）
+    "chars_per_second": 0,  # 输出速度，0 表示不限速
+    "output_chars": 400,
+    "tasks": 3,
+    "steps": 3,
+    "dag": False  # 为 True 时步骤带 depends_on：最后一步依赖前面所有步骤，其余步骤相互独立
+}
+
+FILLER = "胸腺瘤是前纵隔最常见的肿瘤，CT 表现为边界清楚的软组织密度肿块。"
+
+
+def _estimate_tokens(text):
+    # 粗略估算：中文约每字 1 token，英文约每 4 字符 1 token
+    return max(1, len(text) // 2)
+
+
+def build_reply(prompt, settings):
+    """根据请求内容生成固定格式的回复。"""
+    if "'task_name'" in prompt:
+        tasks = [
+            {"task_name": f"子任务{i + 1}", "task_description": f"分析患者数据的第 {i + 1} 个方面"}
+            for i in range(settings["tasks"])
+        ]
+        return json.dumps(tasks, ensure_ascii=False)
+    if "'step_name'" in prompt:
+        steps = [
+            {"step_name": f"步骤{i + 1}", "step_instruction": f"完成第 {i + 1} 个分析步骤"}
+            for i in range(settings["steps"])
+        ]
+        if settings["dag"]:
+            for step in steps:
+                step["depends_on"] = []
+            steps[-1]["depends_on"] = [step["step_name"] for step in steps[:-1]]
+        return json.dumps(steps, ensure_ascii=False)
+    repeat = settings["output_chars"] // len(FILLER) + 1
+    return (FILLER * repeat)[:settings["output_chars"]]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    settings = DEFAULTS
+
+    def log_message(self, format, *args):
+        pass  # 基准测试时不输出访问日志
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            self.send_error(404)
+            return
+
+        messages = request.get("messages", [])
+        prompt = messages[-1]["content"] if messages else ""
+        reply = build_reply(prompt, self.settings)
+        usage = {
+            "prompt_tokens": sum(_estimate_tokens(m.get("content", "")) for m in messages),
+            "completion_tokens": _estimate_tokens(reply)
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        time.sleep(self.settings["latency"])
+
+        if request.get("stream"):
+            self._stream(request, reply)
+        else:
+            self._respond(request, reply, usage)
+
+    def _respond(self, request, reply, usage):
+        cps = self.settings["chars_per_second"]
+        if cps:
+            time.sleep(len(reply) / cps)
+        body = json.dumps({
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model") or "mock",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+            "usage": usage
+        }, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, request, reply):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        cps = self.settings["chars_per_second"]
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        for start in range(0, len(reply), 8):
+            piece = reply[start:start + 8]
+            if cps:
+                time.sleep(len(piece) / cps)
+            chunk = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model") or "mock",
+                "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]
+            }
+            try:
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                return  # 客户端提前结束了流
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_server(port=0, **settings):
+    """在后台线程启动替身服务器，返回 (server, base_url)。port 为 0 时自动选择端口。"""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"settings": {**DEFAULTS, **settings}})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容替身服务器")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=DEFAULTS["latency"])
+    parser.add_argument("--chars-per-second", type=float, default=DEFAULTS["chars_per_second"])
+    parser.add_argument("--output-chars", type=int, default=DEFAULTS["output_chars"])
+    parser.add_argument("--tasks", type=int, default=DEFAULTS["tasks"])
+    parser.add_argument("--steps", type=int, default=DEFAULTS["steps"])
+    parser.add_argument("--dag", action="store_true", help="步骤分解结果带 depends_on")
+    args = parser.parse_args()
+    server, base_url = start_server(
+        args.port, latency=args.latency, chars_per_second=args.chars_per_second,
+        output_chars=args.output_chars, tasks=args.tasks, steps=args.steps, dag=args.dag
+    )
+    print(f"替身服务器已启动: {base_url}（Ctrl+C 退出）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
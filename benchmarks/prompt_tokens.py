@@ -0,0 +1,84 @@
+"""
+对比 BaseAgent.think 旧的提示词组装方式与 build_messages 的 token 数（固定的提示词样例）。
+
+用法: python benchmarks/prompt_tokens.py
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from agents_builder import build_messages, DEFAULT_MEMORY_MAX_TOKENS
+from context_budget import count_tokens
+from prompt_templates import render_prompt
+
+# 固定样例：Chief 先分解任务，再根据各子任务总结生成最终报告
+SYSTEM_PROMPT = "你是一个顶级的医疗项目主管(Chief)。你的任务是理解用户关于患者数据的复杂请求，将其分解为几个逻辑清晰、相互独立的子任务，并为每个子任务设定明确的目标。你的输出必须是结构化的JSON。请确保输出不超过 1000 个 token。"
+PATIENT_RECORD = str({
+    "影像号": 10578915, "是否有病理": "是", "是否出组": "否", "症状": "胸闷、气短两月余，偶有咳嗽",
+    "病理诊断": "胸腺瘤（B2型）", "年龄": 56, "性别": "女", "CT描述": "前纵隔见软组织密度肿块，大小约4.2cm×3.1cm，边界清楚，增强扫描呈轻中度均匀强化",
+    "重症肌无力": "否", "AFP": "2.1 ng/ml", "CEA": "1.8 ng/ml", "NSE": "12.3 ng/ml"
+})
+INITIAL_INPUT = f"【原始数据】:\n{PATIENT_RECORD}\n\n【相关医疗知识】:\n- [hasAbstract] Thymoma is the most common tumor of the anterior mediastinum...\n\n【问题】:\n分析这个病人的各项数据，给出诊断报告"
+SUMMARIES = "\n\n".join([
+    "子任务 '影像分析' 的总结:\n前纵隔肿块，考虑胸腺瘤。",
+    "子任务 '实验室检查' 的总结:\n肿瘤标志物均在正常范围。"
+])
+# 用实际运行时的模板拼接提示词，模板改动后基准结果随之更新。
+# 第三项对应 think(use_memory=...)：汇总提示已包含原始输入，新做法不再附带分解轮次的记忆
+CALLS = [
+    (
+        render_prompt("chief.decompose", initial_input=INITIAL_INPUT),
+        '[{"task_name": "影像分析", "task_description": "分析CT影像表现"}, {"task_name": "实验室检查", "task_description": "解读肿瘤标志物"}]',
+        True
+    ),
+    (
+        render_prompt("chief.summarize", initial_input=INITIAL_INPUT, summaries=SUMMARIES),
+        "最终报告：……",
+        False
+    ),
+]
+
+
+def legacy_messages(system_prompt, memory, input_data):
+    # 旧做法：记忆拼进系统提示，当前输入在系统提示和用户消息中各发送一次
+    context = system_prompt
+    if memory:
+        context += "\n\n推理记忆:\n" + "\n".join([f"输入: {m['input']}\n输出: {m['output']}" for m in memory])
+    context += f"\n\n当前输入: {input_data}"
+    return [{"role": "system", "content": context}, {"role": "user", "content": input_data}]
+
+
+def messages_tokens(messages):
+    return sum(count_tokens(m["content"]) for m in messages)
+
+
+def run(builder, evict, honor_use_memory):
+    memory = []
+    totals = []
+    for input_data, output, use_memory in CALLS:
+        sent_memory = memory if use_memory or not honor_use_memory else []
+        totals.append(messages_tokens(builder(SYSTEM_PROMPT, sent_memory, input_data)))
+        memory.append({"input": input_data, "output": output, "tokens": count_tokens(input_data) + count_tokens(output)})
+        evict(memory)
+    return totals
+
+
+def evict_by_count(memory):
+    if len(memory) > 5:
+        memory.pop(0)
+
+
+def evict_by_tokens(memory):
+    total = sum(m["tokens"] for m in memory)
+    while memory and total > DEFAULT_MEMORY_MAX_TOKENS:
+        total -= memory.pop(0)["tokens"]
+
+
+if __name__ == "__main__":
+    before = run(legacy_messages, evict_by_count, honor_use_memory=False)
+    after = run(build_messages, evict_by_tokens, honor_use_memory=True)
+    print(f"{'调用':<8}{'旧做法':>10}{'新做法':>10}")
+    for i, (b, a) in enumerate(zip(before, after), 1):
+        print(f"{i:<8}{b:>10}{a:>10}")
+    print(f"{'合计':<8}{sum(before):>10}{sum(after):>10}  节省 {1 - sum(after) / sum(before):.1%}")
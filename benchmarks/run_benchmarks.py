@@ -0,0 +1,230 @@
+"""
+离线基准测试：不调用真实 API，测量 get_patient_data、query_knowledge_graph、process_and_save_output
+和 run_hierarchical_team（连接本地替身服务器）的延迟分位数、每个患者的 token 数和吞吐量，
+并与保存的基线比较。
+
+用法:
+    python benchmarks/run_benchmarks.py                       # 运行并与 benchmarks/baseline.json 比较
+    python benchmarks/run_benchmarks.py --rows 100k --patients 50 --latency 0.2
+    python benchmarks/run_benchmarks.py --save-baseline       # 把本次结果保存为新的基线
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, 'src'))
+sys.path.append(BENCH_DIR)
+
+from mock_llm_server import start_server
+from synthetic_data import FIRST_ID, generate_patient_csv, generate_pubmed_corpus, parse_size
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+
+def summarize(samples):
+    """返回延迟样本（秒）的分位数统计（毫秒）。"""
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "p50_ms": pick(0.50),
+        "p90_ms": pick(0.90),
+        "p99_ms": pick(0.99),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "count": len(ordered)
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def bench_patient_lookup(workdir, rows, lookups):
+    from data_reader import PatientStore
+
+    path = generate_patient_csv(os.path.join(workdir, "Thymus_data.csv"), rows)
+    store = PatientStore(path)
+    load_seconds, _ = timed(len, store)  # 首次访问触发加载和建索引
+    warm_store = PatientStore(path)
+    warm_load_seconds, _ = timed(len, warm_store)  # 第二次加载可使用列式缓存（如果安装了 pyarrow）
+
+    rng = random.Random(0)
+    ids = [FIRST_ID + rng.randrange(rows) for _ in range(lookups)]
+    samples = [timed(store.get, i)[0] for i in ids]
+    bulk_seconds, _ = timed(store.get_many, ids)
+    return {
+        "rows": rows,
+        "load_seconds": load_seconds,
+        "warm_load_seconds": warm_load_seconds,
+        "lookup": summarize(samples),
+        "get_many_seconds": bulk_seconds
+    }
+
+
+def bench_knowledge(workdir, articles, queries):
+    from okg.pubmed_cache import configure_pubmed
+    from okg.knowledge_graph import build_knowledge_graph, query_knowledge_graph
+
+    cache_path = os.path.join(workdir, "pubmed.sqlite")
+    configure_pubmed(cache_path=cache_path, offline=True)
+    ids = generate_pubmed_corpus(cache_path, articles, retmax=articles)
+    build_seconds, graph = timed(build_knowledge_graph, ids)
+    terms = ["thymoma", "myasthenia gravis", "胸腺瘤 CT", "prognosis surgery", "thymus"]
+    samples = [timed(query_knowledge_graph, graph, terms[i % len(terms)], top_k=5)[0] for i in range(queries)]
+    return {"articles": articles, "build_seconds": build_seconds, "query": summarize(samples)}
+
+
+def bench_output(workdir, writes):
+    from output_processor import CsvResultSink, SqliteResultSink, process_and_save_output
+
+    results_path = os.path.join(workdir, "results")
+    reasoning = "推理过程 " * 500
+    report = {}
+    for kind, sink in (("csv", CsvResultSink(results_path)), ("sqlite", SqliteResultSink(os.path.join(results_path, "results.sqlite")))):
+        # 同一个影像号反复写入，追加耗时不应随文件变大而增长
+        samples = [timed(process_and_save_output, "10578915", "分析结果", reasoning, sink=sink)[0] for _ in range(writes)]
+        report[kind] = summarize(samples)
+    return report
+
+
+def bench_pipeline(patients, concurrency, latency, output_chars, stream, dag=False):
+    import main
+    from agents_builder import AgentPool
+    from team_runner import run_hierarchical_team
+    from tracing import Tracer
+
+    server, base_url = start_server(latency=latency, output_chars=output_chars, dag=dag)
+    config = copy.deepcopy(main.config)
+    config["LLM"].update({
+        "base_url": base_url, "api_key": "benchmark", "model": "mock",
+        "rpm": 1_000_000, "tpm": 1_000_000_000, "max_attempts": 1
+    })
+    config["cache"]["enabled"] = False
+    agent_pool = AgentPool(config)  # 与 main.py 一样在所有患者之间复用 Agent
+    initial_input = "【原始数据】:\n{'影像号': 10578915, '症状': '胸闷'}\n\n【问题】:\n分析这个病人的各项数据，给出诊断报告"
+
+    def run_one(_):
+        tracer = Tracer("benchmark")
+        with agent_pool.lease(main.chief_agent_info) as chief:
+            seconds, _ = timed(
+                run_hierarchical_team, initial_input, chief, main.manager_prototype_info,
+                main.worker_prototype_info, config, on_token=(lambda name, chunk: None) if stream else None,
+                tracer=tracer, agent_pool=agent_pool
+            )
+        tokens = sum(s.prompt_tokens + s.completion_tokens for s in tracer.spans)
+        return seconds, tokens
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(run_one, range(patients)))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.shutdown()
+
+    return {
+        "patients": patients,
+        "concurrency": concurrency,
+        "latency": summarize([r[0] for r in results]),
+        "tokens_per_patient": sum(r[1] for r in results) / len(results),
+        "patients_per_second": len(results) / elapsed
+    }
+
+
+def flatten(report, prefix=""):
+    flat = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(report, baseline, threshold):
+    """打印与基线的对比，返回退化的指标列表。吞吐量越高越好，其余（耗时、token）越低越好。"""
+    current, previous = flatten(report), flatten(baseline)
+    regressions = []
+    print(f"\n{'指标':<45}{'基线':>14}{'本次':>14}{'变化':>10}")
+    for name, value in current.items():
+        if name not in previous or name.endswith(".count") or previous[name] == 0:
+            continue
+        change = (value - previous[name]) / previous[name]
+        higher_is_better = name.endswith("per_second")
+        worse = -change if higher_is_better else change
+        flag = "  <-- 退化" if worse > threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<45}{previous[name]:>14.4f}{value:>14.4f}{change:>+10.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DHelper 离线基准测试")
+    parser.add_argument("--rows", default="1k", help="合成患者表行数：1k / 100k / 1m 或具体数字")
+    parser.add_argument("--lookups", type=int, default=1000)
+    parser.add_argument("--articles", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--patients", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=2, help="同时运行的患者数")
+    parser.add_argument("--latency", type=float, default=0.05, help="替身服务器每次请求的延迟（秒）")
+    parser.add_argument("--output-chars", type=int, default=400, help="替身服务器普通回复的长度")
+    parser.add_argument("--stream", action="store_true", help="以流式模式运行分层团队")
+    parser.add_argument("--dag", action="store_true", help="替身服务器返回带依赖关系的步骤，Worker 按 DAG 并发执行")
+    parser.add_argument("--skip", default="", help="跳过的测试，逗号分隔：patients,knowledge,output,pipeline")
+    parser.add_argument("--output", help="把结果保存为 JSON 文件")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2, help="超过该比例的变差视为退化")
+    args = parser.parse_args()
+
+    skip = {s.strip() for s in args.skip.split(",") if s.strip()}
+    workdir = tempfile.mkdtemp(prefix="dhelper-bench-")
+    report = {}
+    try:
+        if "patients" not in skip:
+            report["patients"] = bench_patient_lookup(workdir, parse_size(args.rows), args.lookups)
+        if "knowledge" not in skip:
+            report["knowledge"] = bench_knowledge(workdir, args.articles, args.queries)
+        if "output" not in skip:
+            report["output"] = bench_output(workdir, args.writes)
+        if "pipeline" not in skip:
+            report["pipeline"] = bench_pipeline(args.patients, args.concurrency, args.latency, args.output_chars, args.stream, args.dag)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存到 {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n发现 {len(regressions)} 项退化")
+            sys.exit(1)
+    else:
+        print(f"\n没有找到基线 {args.baseline}，可以用 --save-baseline 保存本次结果")
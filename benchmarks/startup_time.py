@@ -0,0 +1,82 @@
+"""
+启动耗时基准：用 python -X importtime 在子进程中导入 main（或其他模块），统计导入总耗时、
+最慢的模块，以及 pandas、openai 等重依赖是否在导入阶段就被加载。
+
+用法:
+    python benchmarks/startup_time.py                    # 导入 main，重复 5 次取中位数
+    python benchmarks/startup_time.py --module team_runner --repeat 10 --top 30
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+# 应当在第一次使用时才导入的重依赖
+HEAVY_MODULES = ["pandas", "openai", "httpx", "requests", "rdflib", "tiktoken", "xml.etree.ElementTree"]
+
+
+def parse_importtime(stderr):
+    """解析 -X importtime 的输出，返回 {模块名: (自身耗时 us, 累计耗时 us, 嵌套深度)}。"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            modules[name.strip()] = (int(self_us), int(cumulative_us), depth)
+        except ValueError:
+            continue  # 其他模块打印到 stderr 的内容
+    return modules
+
+
+def measure(module):
+    """在新的解释器中导入 module，返回 (墙钟耗时秒, importtime 统计)。"""
+    code = f"import sys; sys.path.insert(0, {os.path.join(ROOT_DIR, 'src')!r}); import {module}"
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT_DIR, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+    return elapsed, parse_importtime(result.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DHelper 启动耗时基准（python -X importtime）")
+    parser.add_argument("--module", default="main", help="要导入的模块，默认 main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20, help="列出累计耗时最高的模块数")
+    parser.add_argument("--output", help="把结果保存为 JSON 文件")
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.repeat)]
+    wall = [r[0] for r in runs]
+    modules = runs[-1][1]
+    top_level = {name: times for name, times in modules.items() if times[2] == 0}
+    loaded_heavy = [m for m in HEAVY_MODULES if m in modules]
+
+    print(f"导入 {args.module}：墙钟耗时中位数 {statistics.median(wall) * 1000:.1f} ms（{args.repeat} 次，"
+          f"最快 {min(wall) * 1000:.1f} ms），importtime 累计 {sum(t[1] for t in top_level.values()) / 1000:.1f} ms")
+    print(f"\n{'累计(ms)':>10}{'自身(ms)':>10}  模块")
+    for name, (self_us, cumulative_us, _) in sorted(modules.items(), key=lambda item: -item[1][1])[:args.top]:
+        print(f"{cumulative_us / 1000:>10.1f}{self_us / 1000:>10.1f}  {name}")
+    print(f"\n导入阶段已加载的重依赖: {', '.join(loaded_heavy) if loaded_heavy else '无'}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "module": args.module,
+                "wall_ms": [w * 1000 for w in wall],
+                "median_ms": statistics.median(wall) * 1000,
+                "heavy_loaded": loaded_heavy,
+                "modules": {name: {"self_us": t[0], "cumulative_us": t[1]} for name, t in modules.items()}
+            }, f, ensure_ascii=False, indent=2)
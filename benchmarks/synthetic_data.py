@@ -0,0 +1,104 @@
+"""
+生成基准测试用的合成数据：Thymus_data.csv 格式的患者表和 PubMed 本地缓存语料。
+
+用法:
+    python benchmarks/synthetic_data.py patients --sizes 1k,100k,1m --out-dir benchmarks/data
+    python benchmarks/synthetic_data.py pubmed --articles 5000 --cache benchmarks/data/pubmed.sqlite
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+FIRST_ID = 10000000
+COLUMNS = ['影像号', '是否有病理', '是否出组', '症状', '病理诊断', '年龄', '性别', 'CT描述', 'AFP', 'CEA']
+SYMPTOMS = ['胸闷', '气短', '咳嗽', '胸痛', '眼睑下垂', '无明显症状']
+DIAGNOSES = ['胸腺瘤（A型）', '胸腺瘤（AB型）', '胸腺瘤（B1型）', '胸腺瘤（B2型）', '胸腺瘤（B3型）', '胸腺癌', '胸腺增生']
+CT_FINDINGS = ['前纵隔软组织密度肿块，边界清楚', '前纵隔不规则肿块，侵犯周围脂肪', '前纵隔囊实性病灶', '胸腺区结节影']
+TERMS = ['thymoma', 'thymus', 'thymic carcinoma', 'myasthenia gravis', 'mediastinal mass', 'CT', 'surgery',
+         'radiotherapy', 'prognosis', 'WHO classification', '胸腺瘤', '重症肌无力', '纵隔肿瘤']
+
+SIZES = {"1k": 1000, "100k": 100000, "1m": 1000000}
+
+
+def parse_size(text):
+    text = text.strip().lower()
+    return SIZES[text] if text in SIZES else int(text)
+
+
+def generate_patient_csv(path, rows, seed=0):
+    """生成 rows 行患者数据，影像号从 FIRST_ID 开始连续编号。"""
+    rng = random.Random(seed)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for i in range(rows):
+            writer.writerow([
+                FIRST_ID + i,
+                rng.choice(['是', '否']),
+                rng.choice(['是', '否']),
+                '、'.join(rng.sample(SYMPTOMS, 2)),
+                rng.choice(DIAGNOSES),
+                rng.randint(18, 85),
+                rng.choice(['男', '女']),
+                f"{rng.choice(CT_FINDINGS)}，大小约{rng.uniform(1, 8):.1f}cm",
+                f"{rng.uniform(0.5, 10):.1f} ng/ml",
+                f"{rng.uniform(0.5, 6):.1f} ng/ml"
+            ])
+    return path
+
+
+def synthetic_articles(count, seed=0):
+    rng = random.Random(seed)
+    articles = []
+    for i in range(count):
+        words = rng.choices(TERMS, k=60)
+        articles.append({
+            "pmid": str(30000000 + i),
+            "title": " ".join(rng.sample(TERMS, 5)).capitalize(),
+            "abstract": " ".join(words) + "."
+        })
+    return articles
+
+
+def generate_pubmed_corpus(cache_path, articles, terms=("Thymus", "thymoma"), retmax=5, seed=0):
+    """
+    把合成文章写入 PubMed 本地缓存，并为 terms 中的每个检索词登记检索结果，
+    这样 knowledge_graph 在离线模式下可以完整运行。
+    """
+    from okg.pubmed_cache import PubmedStore
+
+    store = PubmedStore(cache_path)
+    corpus = synthetic_articles(articles, seed)
+    store.put_articles(corpus)
+    ids = [a["pmid"] for a in corpus]
+    for term in terms:
+        store.put_search(term, retmax, ids[:retmax])
+    return ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成基准测试用的合成数据")
+    sub = parser.add_subparsers(dest="command", required=True)
+    patients = sub.add_parser("patients", help="生成 Thymus_data.csv 格式的患者表")
+    patients.add_argument("--sizes", default="1k,100k,1m", help="逗号分隔的行数，例如 1k,100k,1m")
+    patients.add_argument("--out-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    pubmed = sub.add_parser("pubmed", help="生成 PubMed 本地缓存语料")
+    pubmed.add_argument("--articles", type=int, default=5000)
+    pubmed.add_argument("--cache", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "pubmed.sqlite"))
+    args = parser.parse_args()
+
+    if args.command == "patients":
+        for size in args.sizes.split(","):
+            rows = parse_size(size)
+            path = generate_patient_csv(os.path.join(args.out_dir, f"Thymus_data_{size.strip()}.csv"), rows)
+            print(f"已生成 {path}（{rows} 行）")
+    else:
+        generate_pubmed_corpus(args.cache, args.articles)
+        print(f"已写入 {args.articles} 篇合成文章到 {args.cache}")
@@ -1,5 +1,8 @@
 import sys
 import os
+import argparse
+import threading
+import time
 from dotenv import load_dotenv
 
 # 加载.env文件
@@ -15,24 +18,197 @@ config = {
         "max_attempts": 10,
         "temperature": 0.7,
         "max_tokens": 1000,
-        "timeout": 30
+        "timeout": 30,  # 单次 HTTP 请求超时（秒）
+        "deadline": 120,  # 单次 LLM 调用的总截止时间，包括排队和重试（秒）
+        "rpm": 60,  # 每分钟请求数上限（所有 Agent 共享）
+        "tpm": 100000,  # 每分钟 token 数上限（所有 Agent 共享）
+        "circuit_failures": 5,  # 连续失败多少次后熔断
+        "circuit_reset": 60,  # 熔断后多少秒再试探（秒）
+        "max_concurrency": 4,  # 同时执行的 Manager 子树数量上限
+        "max_step_concurrency": 4,  # 同一 Manager 内声明了依赖关系时，同时执行的 Worker 步骤数量上限
+        "memory_max_tokens": 2000,  # 每个 Agent 记忆（历史对话轮次）的 token 上限
+        "json_mode": False,  # 分解任务时使用服务商的 JSON 模式（response_format），服务商拒绝时自动关闭
+        "decompose_reask": 1,  # 分解输出修复后仍无效时，要求模型改正的次数
+        "stream": False  # 流式输出：生成的文本实时打印到终端
+    },
+    "cache": {
+        # 磁盘响应缓存：相同的模型、上下文、输入、temperature 和 max_tokens 直接返回上次的结果
+        "enabled": False,
+        "path": os.path.join(os.path.dirname(__file__), "cache", "llm_responses.sqlite"),
+        "ttl": 7 * 24 * 3600,  # 秒
+        "max_entries": 10000,
+        "replay_only": False,  # 仅回放：未命中时报错而不是调用 API，用于确定性重跑
+        "bypass_types": []  # 不使用缓存的 Agent 类型，例如 ["Worker"]
+    },
+    "knowledge": {
+        # PubMed 本地缓存：命中时不发起任何 HTTP 请求
+        "cache_path": os.path.join(os.path.dirname(__file__), "cache", "pubmed.sqlite"),
+        "ttl": 30 * 24 * 3600,  # 秒
+        "offline": os.getenv("PUBMED_OFFLINE", "") == "1",  # 离线模式：只使用本地缓存
+        "top_k": 5,  # 注入提示词的最相关片段数量
+        "snippet_chars": 500  # 每个片段的最大字符数
+    },
+    "context": {
+        # Worker 链上下文的 token 预算（tiktoken 计数）
+        "worker_budget": 6000,
+        "manager_budget": 8000,  # Manager 汇总请求的总 token 数（含系统提示和模板）
+        "keep_recent": 2,  # 最近几个步骤的结果保留全文
+        "compress_tokens": 200  # 更早步骤的结果压缩到的 token 数
+    },
+    "batch": {
+        "max_workers": 2,  # 批处理时同时分析的患者数量
+        "checkpoint": os.path.join(os.path.dirname(__file__), "results", "batch_checkpoint.jsonl"),  # 按问题区分进度
+        "sink": "sqlite",  # 批处理结果统一写入 results/results.sqlite
+        "metrics_csv": os.path.join(os.path.dirname(__file__), "results", "metrics.csv"),
+        "metrics_prom": os.path.join(os.path.dirname(__file__), "results", "metrics.prom")
+    },
+    "daemon": {
+        # 常驻模式（--serve）：依赖、患者数据和知识检索预热后，通过本地套接字重复处理分析请求
+        "socket": os.path.join(os.path.dirname(__file__), "results", "dhelper.sock"),  # Unix 域套接字
+        "port": 8766,  # 不支持 Unix 域套接字的平台（Windows）改用 127.0.0.1 上的该端口
+        "warm_terms": ["Thymus"]  # 启动时预先检索的疾病词
     },
     "output": {
-        "results_dir": "results"
+        "results_dir": "results",
+        "sink": "csv",  # csv / jsonl / sqlite
+        "traces_dir": os.path.join(os.path.dirname(__file__), "results", "traces")  # 每个影像号一个 JSON 追踪文件
     }
 }
 
+DEFAULT_QUESTION = "分析这个病人的各项数据，给出诊断报告"
+
 # 添加src目录到路径
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
-from data_reader import get_patient_data, print_first_five_columns
-from agents_builder import build_agent
+from data_reader import get_patient_data, get_patient_store, print_first_five_columns
+from agents_builder import AgentPool
+from llm_scheduler import LLMError
 from team_runner import run_hierarchical_team
-from output_processor import process_and_save_output
-from okg.knowledge_graph import fetch_pubmed_data, build_knowledge_graph, query_knowledge_graph
+from output_processor import process_and_save_output, configure_sink, create_sink
+from response_cache import get_response_cache
+from tracing import Tracer, MetricsAggregator
+from batch_runner import BatchCheckpoint, load_imaging_ids, parse_id_range, run_batch
+from context_budget import count_tokens
+from daemon import resolve_address, send_request, serve
+from okg.pubmed_cache import configure_pubmed
+from okg.knowledge_graph import fetch_pubmed_data, build_knowledge_graph, query_knowledge_graph, format_snippets
+
+configure_pubmed(
+    cache_path=config["knowledge"]["cache_path"],
+    ttl=config["knowledge"]["ttl"],
+    offline=config["knowledge"]["offline"]
+)
+
+# 定义三层架构 Agent 的原型信息
+# 这些信息将用于动态创建 Agent
+chief_agent_info = {
+    "name": "Chief_Agent",
+    "role": "总指挥",
+    "type": "Chief",
+    "system_prompt": "你是一个顶级的医疗项目主管(Chief)。你的任务是理解用户关于患者数据的复杂请求，将其分解为几个逻辑清晰、相互独立的子任务，并为每个子任务设定明确的目标。你的输出必须是结构化的JSON。请确保输出不超过 1000 个 token。",
+    "max_tokens": 1000
+}
+
+manager_prototype_info = {
+    # name 将被动态生成
+    "role": "项目经理",
+    "type": "Manager",
+    "system_prompt": "你是一个医疗分析团队的项目经理(Manager)。你的任务是接收一个子任务目标，并将其分解为一系列具体的、可按顺序执行的工作步骤。你的输出必须是结构化的JSON。请确保输出不超过 500 个 token。",
+    "max_tokens": 500
+}
+
+worker_prototype_info = {
+    # name 将被动态生成
+    "role": "分析员",
+    "type": "Worker",
+    "system_prompt": "你是一位专业的医疗数据分析员(Worker)。你的任务是精确地执行给定的指令，并根据提供的上下文信息，生成清晰、准确的结果。请直接回答，不要添加无关内容。请确保输出不超过 500 个 token。",
+    "max_tokens": 500
+}
+
+# 同一进程内所有患者共享的 Agent 池：按原型复用 Chief/Manager/Worker 实例，归还时清空记忆
+agent_pool = AgentPool(config)
+
+# 同一进程内相同疾病词的知识只检索一次（批处理和常驻模式下所有患者共享），
+# 超过 config["knowledge"]["ttl"] 后重新检索。每个疾病词一把锁，不同疾病词的检索互不阻塞
+_related_info_cache = {}  # 疾病词 -> (检索时间, 知识片段)
+_related_info_locks = {}
+_related_info_lock = threading.Lock()  # 只保护 _related_info_locks
+
+def _term_lock(query_term):
+    with _related_info_lock:
+        return _related_info_locks.setdefault(query_term, threading.Lock())
+
+def get_related_info(query_term):
+    ttl = config["knowledge"]["ttl"]
+    with _term_lock(query_term):
+        entry = _related_info_cache.get(query_term)
+        if entry is None or (ttl is not None and time.time() - entry[0] > ttl):
+            ids = fetch_pubmed_data(query_term, max_results=5)
+            graph = build_knowledge_graph(ids)
+            # 只注入最相关的 top_k 个片段，而不是所有匹配的原始三元组
+            results = query_knowledge_graph(graph, query_term, top_k=config["knowledge"]["top_k"])
+            entry = (time.time(), format_snippets(results, config["knowledge"]["snippet_chars"]))
+            _related_info_cache[query_term] = entry
+        return entry[1]
+
+_print_lock = threading.Lock()
+
+def print_token(agent_name, chunk):
+    # 流式输出回调；Manager 并行时会从多个线程调用
+    with _print_lock:
+        print(chunk, end="", flush=True)
+
+def analyze_patient(imaging_id, patient_data, question, metrics=None):
+    """
+    对单个患者运行完整的分析流程并保存结果，返回最终分析结果。
+    追踪记录写入 results/traces/<影像号>.json；传入 metrics 时同时汇总到批处理指标中。
+    """
+    tracer = Tracer(imaging_id)
+    try:
+        return _analyze_patient(imaging_id, patient_data, question, tracer)
+    finally:
+        tracer.export_json(os.path.join(config["output"]["traces_dir"], f"{imaging_id}.json"))
+        if metrics is not None:
+            metrics.add(tracer)
+
+def _analyze_patient(imaging_id, patient_data, question, tracer):
+    # 构建或查询知识图谱
+    query_term = patient_data.get('disease', 'Thymus')
+    with tracer.span("Knowledge", query_term, "retrieve"):
+        related_info = get_related_info(query_term)
+
+    # 组合最终输入
+    initial_input = f"【原始数据】:\n{str(patient_data)}\n\n【相关医疗知识】:\n{str(related_info)}\n\n【问题】:\n{question}"
+
+    print(f"正在分析影像号 {imaging_id} ...")
+
+    # 1. 创建 Chief Agent（从池中复用）
+    with agent_pool.lease(chief_agent_info) as chief_agent:
+        # 2. 运行分层团队
+        reasoning_process, analysis_result = run_hierarchical_team(
+            initial_input=initial_input,
+            chief_agent=chief_agent,
+            manager_prototype_info=manager_prototype_info,
+            worker_prototype_info=worker_prototype_info,
+            config=config,
+            on_token=print_token if config["LLM"]["stream"] else None,
+            tracer=tracer,
+            agent_pool=agent_pool
+        )
+
+    # 3. 处理并保存输出
+    # 将列表形式的推理过程转换为字符串
+    reasoning_str = "\n\n".join(reasoning_process)
+    process_and_save_output(imaging_id, analysis_result, reasoning_str)
+    return analysis_result
+
+def print_cache_stats():
+    response_cache = get_response_cache(config["cache"])
+    if response_cache is not None:
+        print(f"LLM 响应缓存统计: {response_cache.stats()}")
 
 def main():
-    
+
     # 10578915
     imaging_id = input("请输入影像号: ")
 
@@ -45,66 +221,124 @@ def main():
     # 输入问题
     question = input("请输入问题（默认为'分析病人数据并生成诊断报告'）: ").strip()
     if not question:
-        question = "分析这个病人的各项数据，给出诊断报告"
+        question = DEFAULT_QUESTION
 
     # 输出前五列数据
     print_first_five_columns(patient_data)
 
-    # 构建或查询知识图谱
-    query_term = patient_data.get('disease', 'Thymus')
-    ids = fetch_pubmed_data(query_term, max_results=5)
-    graph = build_knowledge_graph(ids)
-    related_info = query_knowledge_graph(graph, query_term)
-    
-    # 组合最终输入
-    initial_input = f"【原始数据】:\n{str(patient_data)}\n\n【相关医疗知识】:\n{str(related_info)}\n\n【问题】:\n{question}"
-
-    print(f"正在分析影像号 {imaging_id} ...")
+    configure_sink(create_sink(config["output"]["sink"], config["output"]["results_dir"]))
+    try:
+        analyze_patient(imaging_id, patient_data, question)
+    except LLMError as e:
+        print(f"分析失败: {type(e).__name__}: {e}")
+        return
 
-    # 定义三层架构 Agent 的原型信息
-    # 这些信息将用于动态创建 Agent
-    chief_agent_info = {
-        "name": "Chief_Agent",
-        "role": "总指挥",
-        "type": "Chief",
-        "system_prompt": "你是一个顶级的医疗项目主管(Chief)。你的任务是理解用户关于患者数据的复杂请求，将其分解为几个逻辑清晰、相互独立的子任务，并为每个子任务设定明确的目标。你的输出必须是结构化的JSON。请确保输出不超过 1000 个 token。",
-        "max_tokens": 1000
-    }
+    print(f"\n分析完成，结果已保存到 {config['output']['results_dir']}/ ({config['output']['sink']})")
 
-    manager_prototype_info = {
-        # name 将被动态生成
-        "role": "项目经理",
-        "type": "Manager",
-        "system_prompt": "你是一个医疗分析团队的项目经理(Manager)。你的任务是接收一个子任务目标，并将其分解为一系列具体的、可按顺序执行的工作步骤。你的输出必须是结构化的JSON。请确保输出不超过 500 个 token。",
-        "max_tokens": 500
-    }
+    print_cache_stats()
 
-    worker_prototype_info = {
-        # name 将被动态生成
-        "role": "分析员",
-        "type": "Worker",
-        "system_prompt": "你是一位专业的医疗数据分析员(Worker)。你的任务是精确地执行给定的指令，并根据提供的上下文信息，生成清晰、准确的结果。请直接回答，不要添加无关内容。请确保输出不超过 500 个 token。",
-        "max_tokens": 500
-    }
+def main_batch(imaging_ids, question=DEFAULT_QUESTION, max_workers=None, checkpoint_path=None, fresh=False):
+    """
+    非交互批处理：共享的资源（配置、患者数据、知识图谱、LLM 客户端）只加载一次，
+    患者之间相互独立，用有界线程池并行处理，并支持断点续跑。
+    """
+    store = get_patient_store()
+    # 只跳过以相同问题完成过的影像号；换了问题的批处理会重新分析这些患者
+    checkpoint = BatchCheckpoint(checkpoint_path or config["batch"]["checkpoint"], scope=question)
+    configure_sink(create_sink(config["batch"]["sink"], config["output"]["results_dir"]))
+    metrics = MetricsAggregator()
 
-    # 1. 创建 Chief Agent
-    chief_agent = build_agent(config, chief_agent_info)
+    def process(imaging_id):
+        patient_data = store.get(imaging_id)
+        if patient_data is None:
+            return "missing"
+        analyze_patient(imaging_id, patient_data, question, metrics=metrics)
+        return "done"
 
-    # 2. 运行分层团队
-    reasoning_process, analysis_result = run_hierarchical_team(
-        initial_input=initial_input,
-        chief_agent=chief_agent,
-        manager_prototype_info=manager_prototype_info,
-        worker_prototype_info=worker_prototype_info,
-        config=config
+    summary = run_batch(
+        imaging_ids,
+        process,
+        checkpoint,
+        max_workers=max_workers or config["batch"]["max_workers"],
+        fresh=fresh
     )
+    metrics.write_csv(config["batch"]["metrics_csv"])
+    metrics.write_prometheus(config["batch"]["metrics_prom"])
+    print(f"指标已导出到 {config['batch']['metrics_csv']} 和 {config['batch']['metrics_prom']}")
+    print_cache_stats()
+    return summary
 
-    # 3. 处理并保存输出
-    # 将列表形式的推理过程转换为字符串
-    reasoning_str = "\n\n".join(reasoning_process)
-    process_and_save_output(imaging_id, analysis_result, reasoning_str)
+def daemon_address():
+    return resolve_address(config["daemon"]["socket"], config["daemon"]["port"])
+
+def warm_up():
+    # 提前加载患者数据、知识检索结果和各个重依赖（pandas、openai、tiktoken、rdflib），第一个请求不再付出这些开销
+    print(f"已加载 {len(get_patient_store())} 条患者数据")
+    for term in config["daemon"]["warm_terms"]:
+        try:
+            get_related_info(term)
+        except Exception as e:
+            print(f"警告: 预热知识检索 '{term}' 失败，将在第一次请求时重试: {e}")
+    agent_pool.release(agent_pool.acquire(chief_agent_info))
+    count_tokens("预热")
+
+def handle_daemon_request(request):
+    """处理一个守护进程请求：{"imaging_id": ..., "question": ...}。"""
+    imaging_id = str(request.get("imaging_id", "")).strip()
+    patient_data = get_patient_store().get(imaging_id)
+    if patient_data is None:
+        return {"status": "missing", "imaging_id": imaging_id}
+    try:
+        result = analyze_patient(imaging_id, patient_data, request.get("question") or DEFAULT_QUESTION)
+    except LLMError as e:
+        return {"status": "error", "imaging_id": imaging_id, "error": f"{type(e).__name__}: {e}"}
+    return {"status": "done", "imaging_id": imaging_id, "result": result}
+
+def main_serve():
+    """
+    常驻模式：进程保持运行，依赖和共享资源只加载一次，适合频繁的单患者调用（配合 --send）。
+    """
+    configure_sink(create_sink(config["output"]["sink"], config["output"]["results_dir"]))
+    warm_up()
+    serve(daemon_address(), handle_daemon_request)
+
+def main_send(imaging_id, question=DEFAULT_QUESTION):
+    """把一个分析请求发给已启动的守护进程并打印结果，返回进程退出码。"""
+    try:
+        response = send_request(daemon_address(), {"imaging_id": imaging_id, "question": question})
+    except OSError as e:
+        print(f"无法连接守护进程 {daemon_address()}: {e}（请先运行 python main.py --serve）")
+        return 1
+    if response["status"] == "done":
+        print(response["result"])
+        return 0
+    if response["status"] == "missing":
+        print(f"未找到影像号 {imaging_id} 的数据")
+    else:
+        print(f"分析失败: {response.get('error')}")
+    return 1
 
-    print(f"\n分析完成，结果已保存到 results/{imaging_id}.csv")
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="DHelper 医疗影像分析")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--ids-file", help="批处理：影像号列表文件，每行一个")
+    group.add_argument("--id-range", help="批处理：影像号范围，例如 10578900-10579000")
+    group.add_argument("--serve", action="store_true", help="常驻模式：在本地套接字上重复处理分析请求")
+    group.add_argument("--send", metavar="影像号", help="把分析请求发给已启动的常驻进程")
+    parser.add_argument("--question", default=DEFAULT_QUESTION, help="批处理或 --send 时对每个患者提出的问题")
+    parser.add_argument("--workers", type=int, help="批处理时同时分析的患者数量")
+    parser.add_argument("--checkpoint", help="批处理断点文件路径")
+    parser.add_argument("--fresh", action="store_true", help="批处理时忽略断点中的已完成记录，全部重新分析")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.serve:
+        main_serve()
+    elif args.send:
+        sys.exit(main_send(args.send, args.question))
+    elif args.ids_file or args.id_range:
+        ids = load_imaging_ids(args.ids_file) if args.ids_file else parse_id_range(args.id_range)
+        main_batch(ids, question=args.question, max_workers=args.workers, checkpoint_path=args.checkpoint, fresh=args.fresh)
+    else:
+        main()
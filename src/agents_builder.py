@@ -1,134 +1,432 @@
-import os
-from openai import OpenAI
-from typing import List, Dict, Any
+import logging
+import threading
+from contextlib import contextmanager
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
+from llm_client import get_client
+from llm_scheduler import get_scheduler, to_llm_error, LLMRequestError
+from response_cache import get_response_cache
+from context_budget import count_tokens
+from structured_output import JSON_MODE, JsonArrayStream, parse_json_array, validate_items
+from prompt_templates import render_prompt
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_MAX_TOKENS = 2000
+
+# 拒绝了 JSON 模式（response_format）的 (base_url, model)，之后不再发送该参数
+_json_mode_unsupported = set()
+_json_mode_lock = threading.Lock()
+
+def build_messages(system_prompt: str, memory: List[Dict[str, Any]], input_data: str) -> List[Dict[str, str]]:
+    """
+    组装对话消息：系统提示、记忆中的历史轮次（user/assistant）、当前输入，每段内容只发送一次。
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    for m in memory:
+        messages.append({"role": "user", "content": m["input"]})
+        messages.append({"role": "assistant", "content": m["output"]})
+    messages.append({"role": "user", "content": input_data})
+    return messages
 
 class BaseAgent:
-    def __init__(self, name: str, role: str, system_prompt: str, config: Dict[str, Any]):
+    __slots__ = ("name", "role", "system_prompt", "config", "max_tokens", "agent_type", "memory", "calls", "client", "scheduler", "cache")
+
+    def __init__(self, name: str, role: str, system_prompt: str, config: Dict[str, Any], max_tokens: int = 1000, agent_type: str = "Base"):
         self.name = name
         self.role = role
         self.system_prompt = system_prompt
-        self.config = config
+        self.config = config  # 同一配置的所有 Agent 共享，不做复制
+        self.max_tokens = max_tokens
+        self.agent_type = agent_type
         self.memory = []  # 添加独立记忆列表
-        # 创建OpenAI客户端
-        self.client = OpenAI(
-            api_key=self.config["LLM"]["api_key"],
-            base_url=self.config["LLM"]["base_url"]
+        self.calls = []  # 尚未被追踪器取走的调用统计（见 pop_calls）
+        # 复用进程内共享的OpenAI客户端（连接池和超时来自 config["LLM"]）
+        self.client = get_client(self.config["LLM"])
+        # 共享的请求调度器：限流、重试退避、截止时间和熔断
+        self.scheduler = get_scheduler(self.config["LLM"])
+        # 可选的磁盘响应缓存；在 config["cache"]["bypass_types"] 中的 Agent 类型不走缓存
+        self.cache = None
+        cache_config = self.config.get("cache")
+        if cache_config and agent_type not in cache_config.get("bypass_types", []):
+            self.cache = get_response_cache(cache_config)
+
+    def reset(self, name: str) -> None:
+        """清空记忆和调用统计，以新的名字复用该实例（见 AgentPool）。"""
+        self.name = name
+        self.memory = []
+        self.calls = []
+
+    def remember(self, input_data: str, output: str) -> None:
+        """
+        更新记忆：按 token 数淘汰最早的轮次，总量不超过 config["LLM"]["memory_max_tokens"]。
+        """
+        self.memory.append({"input": input_data, "output": output, "tokens": count_tokens(input_data) + count_tokens(output)})
+        max_tokens = self.config["LLM"].get("memory_max_tokens", DEFAULT_MEMORY_MAX_TOKENS)
+        total = sum(m["tokens"] for m in self.memory)
+        while self.memory and total > max_tokens:
+            total -= self.memory.pop(0)["tokens"]
+
+    def pop_calls(self) -> List[Dict[str, Any]]:
+        """取出并清空自上次调用以来的 LLM 调用统计（token、缓存命中、排队时间、重试次数），供追踪使用。"""
+        calls, self.calls = self.calls, []
+        return calls
+
+    def _cache_lookup(self, messages: List[Dict[str, str]]) -> Tuple[Optional[str], Optional[str]]:
+        """返回 (缓存键, 命中的输出)；未启用缓存时均为 None。"""
+        if self.cache is None:
+            return None, None
+        cache_key = self.cache.make_key(
+            self.config["LLM"]["model"], messages,
+            self.config["LLM"]["temperature"], self.max_tokens
         )
+        return cache_key, self.cache.get(cache_key)
 
-    def think(self, input_data: str) -> str:
-        try:
-            # 构建上下文：系统提示 + 记忆 + 当前输入
-            context = self.system_prompt
-            if self.memory:
-                context += "\n\n推理记忆:\n" + "\n".join([f"输入: {m['input']}\n输出: {m['output']}" for m in self.memory])
-            context += f"\n\n当前输入: {input_data}"
-            
-            completion = self.client.chat.completions.create(
+    def _json_mode(self) -> Optional[Dict[str, str]]:
+        """config["LLM"]["json_mode"] 打开且服务商没有拒绝过时，返回要发送的 response_format。"""
+        if not self.config["LLM"].get("json_mode"):
+            return None
+        if (self.config["LLM"].get("base_url"), self.config["LLM"]["model"]) in _json_mode_unsupported:
+            return None
+        return JSON_MODE
+
+    def _create_completion(self, messages: List[Dict[str, str]], stream: bool, stats: Dict[str, Any], response_format: Optional[Dict[str, str]] = None):
+        """
+        通过共享调度器发起请求；失败时抛出 llm_scheduler.LLMError 的子类。排队时间和重试次数写入 stats。
+        服务商以 400 拒绝 response_format 时，记住该模型不支持 JSON 模式并去掉该参数重试一次。
+        """
+        estimated_tokens = sum(count_tokens(m["content"]) for m in messages) + self.max_tokens
+        request_timeout = self.config["LLM"].get("timeout")
+        extra = {"response_format": response_format} if response_format is not None else {}
+
+        def _request(remaining: float):
+            return self.client.chat.completions.create(
                 model=self.config["LLM"]["model"],
-                messages=[
-                    {"role": "system", "content": context},  # 使用增强上下文
-                    {"role": "user", "content": input_data}
-                ],
+                messages=messages,
                 temperature=self.config["LLM"]["temperature"],
-                max_tokens=self.config["max_tokens"],
-                stream=False
+                max_tokens=self.max_tokens,
+                stream=stream,
+                timeout=min(remaining, request_timeout) if request_timeout else remaining,
+                **extra
             )
-            output = completion.choices[0].message.content
-            
-            # 更新记忆（限制长度，避免过长）
-            self.memory.append({"input": input_data, "output": output})
-            if len(self.memory) > 5:  # 例如，保留最近5条
-                self.memory.pop(0)
-            
-            return output
+
+        try:
+            completion = self.scheduler.call(_request, estimated_tokens, stats=stats)
+        except LLMRequestError as e:
+            if not extra or getattr(e.__cause__, "status_code", None) != 400:
+                raise
+            logger.warning("模型 %s 不支持 JSON 模式，改为普通输出: %s", self.config["LLM"]["model"], e)
+            with _json_mode_lock:
+                _json_mode_unsupported.add((self.config["LLM"].get("base_url"), self.config["LLM"]["model"]))
+            extra = {}
+            completion = self.scheduler.call(_request, estimated_tokens, stats=stats)
+        if stream:
+            # 流式调用在读完或关闭时才知道实际用量，届时由 _finish_stream 归还多预留的配额
+            stats["reserved_tokens"] = estimated_tokens
+        else:
+            usage = getattr(completion, "usage", None)
+            self.scheduler.settle_tokens(estimated_tokens, usage.total_tokens if usage else None)
+            if usage is not None:
+                stats["prompt_tokens"] = usage.prompt_tokens
+                stats["completion_tokens"] = usage.completion_tokens
+        return completion
+
+    def think(
+        self,
+        input_data: str,
+        on_token: Optional[Callable[[str], None]] = None,
+        response_format: Optional[Dict[str, str]] = None,
+        use_memory: bool = True
+    ) -> str:
+        """
+        调用LLM并返回完整输出。传入 on_token 时以流式方式调用，每收到一段文本就回调一次。
+        use_memory 为 False 时不发送记忆中的历史轮次（输入已包含所需的全部内容时使用，避免重复发送）。
+        失败时抛出 llm_scheduler.LLMError 的子类，而不是把错误信息当作输出返回。
+        """
+        if on_token is not None:
+            chunks = []
+            for chunk in self.think_stream(input_data, response_format=response_format, use_memory=use_memory):
+                on_token(chunk)
+                chunks.append(chunk)
+            return "".join(chunks)
+
+        # 构建上下文：系统提示 + 记忆（历史对话轮次） + 当前输入
+        messages = build_messages(self.system_prompt, self.memory if use_memory else [], input_data)
+        output = self._complete(messages, response_format)
+        self.remember(input_data, output)
+
+        return output
+
+    def _complete(self, messages: List[Dict[str, str]], response_format: Optional[Dict[str, str]] = None) -> str:
+        """对给定消息发起一次非流式调用（带缓存），不读写记忆。"""
+        cache_key, output = self._cache_lookup(messages)
+        stats = {"cache_hit": output is not None}
+        self.calls.append(stats)
+
+        if output is None:
+            completion = self._create_completion(messages, stream=False, stats=stats, response_format=response_format)
+            output = completion.choices[0].message.content or ""
+            if "prompt_tokens" not in stats:
+                # 服务商未返回 usage 时用 tiktoken 估算
+                stats["prompt_tokens"] = sum(count_tokens(m["content"]) for m in messages)
+                stats["completion_tokens"] = count_tokens(output)
+            if cache_key is not None:
+                self.cache.put(cache_key, output)
+        return output
+
+    def _finish_stream(self, stream, stats: Dict[str, Any], output: str) -> None:
+        # 关闭连接，记录输出 token 数，并按实际用量归还 TPM 配额
+        stream.close()
+        stats["completion_tokens"] = count_tokens(output)
+        self.scheduler.settle_tokens(stats.pop("reserved_tokens", 0), stats["prompt_tokens"] + stats["completion_tokens"])
+
+    def think_stream(
+        self,
+        input_data: str,
+        response_format: Optional[Dict[str, str]] = None,
+        is_complete: Optional[Callable[[], bool]] = None,
+        use_memory: bool = True
+    ) -> Iterator[str]:
+        """
+        流式调用LLM，逐段产出文本。调用方提前结束迭代时会关闭连接，已收到的部分仍写入记忆；
+        只有 is_complete() 为 True（调用方已拿到完整结果，例如 JSON 列表已结束）时才写入缓存。
+        读取过程中出错（连接中断、SSE 错误事件）时关闭连接，并抛出对应的 llm_scheduler.LLMError 子类。
+        use_memory 的含义同 think。
+        """
+        messages = build_messages(self.system_prompt, self.memory if use_memory else [], input_data)
+        cache_key, cached = self._cache_lookup(messages)
+        stats = {"cache_hit": cached is not None}
+        self.calls.append(stats)
+        if cached is not None:
+            self.remember(input_data, cached)
+            yield cached
+            return
+
+        # 流式响应不一定带 usage，token 数用 tiktoken 估算
+        stats["prompt_tokens"] = sum(count_tokens(m["content"]) for m in messages)
+        stream = self._create_completion(messages, stream=True, stats=stats, response_format=response_format)
+        chunks = []
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks.append(delta)
+                    yield delta
+        except GeneratorExit:
+            output = "".join(chunks)
+            self._finish_stream(stream, stats, output)
+            if cache_key is not None and is_complete is not None and is_complete():
+                self.cache.put(cache_key, output)
+            self.remember(input_data, output)
+            raise
         except Exception as e:
-            return f"Error: {str(e)}"
+            self._finish_stream(stream, stats, "".join(chunks))
+            raise to_llm_error(e) from e
+
+        output = "".join(chunks)
+        self._finish_stream(stream, stats, output)
+        if cache_key is not None:
+            self.cache.put(cache_key, output)
+        self.remember(input_data, output)
+
+    # 分解结果中每个对象必须包含的字段，由 Chief/Manager 指定
+    required_keys: Tuple[str, ...] = ()
+
+    def _decomposition_request(self, decomposition_prompt: str) -> Tuple[str, Optional[Dict[str, str]]]:
+        # JSON 模式要求顶层输出为对象，提示模型把列表放进对象里
+        response_format = self._json_mode()
+        if response_format is not None:
+            decomposition_prompt += render_prompt("structured.json_mode")
+        return decomposition_prompt, response_format
+
+    def _decompose(self, decomposition_prompt: str) -> List[Dict[str, str]]:
+        prompt, response_format = self._decomposition_request(decomposition_prompt)
+        return self._parse_decomposition(self.think(prompt, response_format=response_format))
+
+    def _parse_decomposition(self, raw_decomposition: str) -> List[Dict[str, str]]:
+        """
+        解析并校验分解结果（parse_json_array 会先修复常见格式问题）。仍然无效时只把这段输出
+        发回给模型要求改正（不带原始输入和记忆），最多 config["LLM"]["decompose_reask"] 次；
+        都失败时保留能用的对象，而不是丢弃整个分支。
+        """
+        items = parse_json_array(raw_decomposition)
+        valid, invalid = validate_items(items or [], self.required_keys)
+        if valid and not invalid:
+            return valid
+
+        raw = raw_decomposition
+        for _ in range(self.config["LLM"].get("decompose_reask", 1)):
+            problem = "不是有效的JSON列表" if items is None else f"有 {len(invalid)} 个对象缺少必需字段或字段为空" if invalid else "是空列表"
+            print(f"警告: {self.name} 的分解输出{problem}，要求模型改正")
+            prompt, response_format = self._decomposition_request(render_prompt(
+                "structured.reask", problem=problem, keys="、".join(self.required_keys), output=raw
+            ))
+            raw = self._complete(build_messages(self.system_prompt, [], prompt), response_format)
+            items = parse_json_array(raw)
+            retried_valid, invalid = validate_items(items or [], self.required_keys)
+            if retried_valid and not invalid:
+                return retried_valid
+            if len(retried_valid) > len(valid):
+                valid = retried_valid
+
+        if not valid:
+            print(f"警告: {self.name} 未能解析分解的输出: {raw_decomposition}")
+        return valid  # 如果解析失败，返回空列表
+
+    def _decompose_stream(self, decomposition_prompt: str, on_token: Optional[Callable[[str], None]] = None) -> Iterator[Dict[str, str]]:
+        """
+        流式分解：JSON 列表中的每个有效对象一生成完就产出，列表结束后不再等待剩余输出。
+        增量解析失败或有对象缺少字段时，回退到 _parse_decomposition（修复、必要时重新询问），只补上尚未产出的对象。
+        """
+        prompt, response_format = self._decomposition_request(decomposition_prompt)
+        parser = JsonArrayStream()
+        text = []
+        yielded = []
+        complete = True
+        # 列表结束后提前关闭连接；此时已收到的文本就是完整结果，照常写入缓存
+        stream = self.think_stream(prompt, response_format=response_format, is_complete=lambda: parser.done and not parser.failed)
+        # LLM 调用失败时异常直接向上抛出
+        try:
+            for chunk in stream:
+                if on_token is not None:
+                    on_token(chunk)
+                text.append(chunk)
+                for item in parser.feed(chunk):
+                    valid, _ = validate_items([item], self.required_keys)
+                    if valid:
+                        yielded.append(valid[0])
+                        yield valid[0]
+                    else:
+                        complete = False
+                if parser.done or parser.failed:
+                    break
+            if parser.failed:
+                # 继续读完输出，再按完整文本解析
+                for chunk in stream:
+                    if on_token is not None:
+                        on_token(chunk)
+                    text.append(chunk)
+        finally:
+            stream.close()
+
+        if yielded and complete and parser.done and not parser.failed:
+            return
+        # 前面的对象已经产出，只补上剩余的部分
+        for item in self._parse_decomposition("".join(text)):
+            if item not in yielded:
+                yield item
 
 class ChiefAgent(BaseAgent):
     """
     Chief Agent: 负责接收原始输入，将其分解为几个主要的子任务，并为每个子任务指派一个Manager。
     """
+    __slots__ = ()
+    required_keys = ("task_name", "task_description")
+
+    def _decomposition_prompt(self, initial_input: str) -> str:
+        return render_prompt("chief.decompose", initial_input=initial_input)
+
     def decompose_task(self, initial_input: str) -> List[Dict[str, str]]:
         # 使用LLM将主任务分解为子任务描述列表
-        # 为了简化，我们这里使用 think 方法，并要求它输出特定格式
-        # 在实际应用中，可以增加更复杂的解析逻辑
-        decomposition_prompt = f"根据以下用户请求，将其分解为多个独立的子任务，并为每个子任务定义一个目标。请以JSON格式的列表输出，每个对象包含'task_name'和'task_description'。例如：[{{\"task_name\": \"数据分析\", \"task_description\": \"分析患者的临床数据\"}}, ...]。\n\n用户请求：\n{initial_input}"
-        raw_decomposition = self.think(decomposition_prompt)
-        
-        try:
-            # 尝试解析LLM返回的JSON字符串
-            import json
-            # 清理输出，找到json部分
-            start_index = raw_decomposition.find('[')
-            end_index = raw_decomposition.rfind(']') + 1
-            if start_index != -1 and end_index != -1:
-                json_str = raw_decomposition[start_index:end_index]
-                tasks = json.loads(json_str)
-                if isinstance(tasks, list):
-                    return tasks
-            print(f"警告: Chief Agent未能解析任务分解的输出: {raw_decomposition}")
-            return []
-        except json.JSONDecodeError:
-            print(f"警告: Chief Agent输出的JSON格式错误: {raw_decomposition}")
-            return [] # 如果解析失败，返回空列表
+        return self._decompose(self._decomposition_prompt(initial_input))
+
+    def decompose_task_stream(self, initial_input: str, on_token: Optional[Callable[[str], None]] = None) -> Iterator[Dict[str, str]]:
+        # 流式版本：每个子任务一解析出来就产出，调用方可以立即启动对应的Manager
+        return self._decompose_stream(self._decomposition_prompt(initial_input), on_token)
 
 class ManagerAgent(BaseAgent):
     """
     Manager Agent: 接收一个子任务，将其进一步分解为可执行的、更小的步骤，并指派给Worker。
     """
+    __slots__ = ()
+    required_keys = ("step_name", "step_instruction")
+
+    def _decomposition_prompt(self, sub_task_description: str) -> str:
+        return render_prompt("manager.decompose", sub_task_description=sub_task_description)
+
     def decompose_sub_task(self, sub_task_description: str) -> List[Dict[str, str]]:
         # 与Chief类似，将子任务分解为更小的步骤
-        decomposition_prompt = f"根据以下子任务描述，将其分解为多个具体的、可执行的工作步骤。请以JSON格式的列表输出，每个对象包含'step_name'和'step_instruction'。例如：[{{\"step_name\": \"提取关键指标\", \"step_instruction\": \"从数据中提取血压、血糖值\"}}, ...]。\n\n子任务描述：\n{sub_task_description}"
-        raw_decomposition = self.think(decomposition_prompt)
-        
-        try:
-            import json
-            start_index = raw_decomposition.find('[')
-            end_index = raw_decomposition.rfind(']') + 1
-            if start_index != -1 and end_index != -1:
-                json_str = raw_decomposition[start_index:end_index]
-                steps = json.loads(json_str)
-                if isinstance(steps, list):
-                    return steps
-            print(f"警告: Manager Agent未能解析步骤分解的输出: {raw_decomposition}")
-            return []
-        except json.JSONDecodeError:
-            print(f"警告: Manager Agent输出的JSON格式错误: {raw_decomposition}")
-            return []
+        return self._decompose(self._decomposition_prompt(sub_task_description))
+
+    def decompose_sub_task_stream(self, sub_task_description: str, on_token: Optional[Callable[[str], None]] = None) -> Iterator[Dict[str, str]]:
+        return self._decompose_stream(self._decomposition_prompt(sub_task_description), on_token)
 
 class WorkerAgent(BaseAgent):
     """
     Worker Agent: 负责执行具体的工作步骤。
     """
-    def execute_step(self, step_instruction: str, context: str) -> str:
+    __slots__ = ()
+
+    def execute_step(self, step_instruction: str, context: str, on_token: Optional[Callable[[str], None]] = None) -> str:
         # Worker直接执行指令
-        prompt = f"请根据以下指令和上下文，完成任务并返回结果。\n\n上下文:\n{context}\n\n指令: {step_instruction}"
-        return self.think(prompt)
+        prompt = render_prompt("worker.execute", context=context, step_instruction=step_instruction)
+        return self.think(prompt, on_token=on_token)
+
+AGENT_CLASSES = {
+    "Chief": ChiefAgent,
+    "Manager": ManagerAgent,
+    "Worker": WorkerAgent,
+    "Base": BaseAgent
+}
 
 def build_agent(config: Dict[str, Any], agent_info: Dict[str, Any]) -> BaseAgent:
     """
     根据信息创建一个Agent实例。
     """
-    name = agent_info["name"]
-    role = agent_info["role"]
-    system_prompt = agent_info["system_prompt"]
     agent_type = agent_info.get("type", "Worker") # 默认为Worker
+    agent_class = AGENT_CLASSES.get(agent_type, WorkerAgent)
+    agent = agent_class(
+        agent_info["name"], agent_info["role"], agent_info["system_prompt"], config,
+        max_tokens=agent_info.get("max_tokens", 1000), agent_type=agent_type
+    )
+    logger.debug("Agent '%s' (类型: %s) 已创建。", agent.name, agent_type)
+    return agent
+
+class AgentPool:
+    """
+    按原型（类型、角色、系统提示、max_tokens）复用 Agent 实例。归还时清空记忆，
+    因此复用的 Agent 与新建的行为一致；批处理时避免为每个步骤重新创建 Worker。线程安全。
+    """
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self._idle: Dict[Tuple[str, str, str, int], List[BaseAgent]] = {}
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
 
-    agent_config = config.copy()
-    agent_config["max_tokens"] = agent_info.get("max_tokens", 1000)
+    @staticmethod
+    def _key(agent_info: Dict[str, Any]) -> Tuple[str, str, str, int]:
+        return (agent_info.get("type", "Worker"), agent_info["role"], agent_info["system_prompt"], agent_info.get("max_tokens", 1000))
 
-    agent_class_map = {
-        "Chief": ChiefAgent,
-        "Manager": ManagerAgent,
-        "Worker": WorkerAgent,
-        "Base": BaseAgent
-    }
-    
-    agent_class = agent_class_map.get(agent_type, WorkerAgent)
-    
-    agent = agent_class(name, role, system_prompt, agent_config)
-    print(f"Agent '{agent.name}' (类型: {agent_type}) 已创建。")
-    return agent
+    def acquire(self, agent_info: Dict[str, Any], name: Optional[str] = None) -> BaseAgent:
+        """取出一个空闲的同原型 Agent 并改名为 name（默认 agent_info["name"]），没有空闲实例时新建。"""
+        name = name or agent_info["name"]
+        with self._lock:
+            idle = self._idle.get(self._key(agent_info))
+            agent = idle.pop() if idle else None
+            if agent is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if agent is None:
+            return build_agent(self.config, {**agent_info, "name": name})
+        agent.reset(name)
+        return agent
+
+    def release(self, agent: BaseAgent) -> None:
+        agent.reset(agent.name)
+        key = (agent.agent_type, agent.role, agent.system_prompt, agent.max_tokens)
+        with self._lock:
+            self._idle.setdefault(key, []).append(agent)
+
+    @contextmanager
+    def lease(self, agent_info: Dict[str, Any], name: Optional[str] = None) -> Iterator[BaseAgent]:
+        agent = self.acquire(agent_info, name)
+        try:
+            yield agent
+        finally:
+            self.release(agent)
 
 def build_multiagent_team(config: Dict[str, Any], agents_info: List[Dict[str, Any]]) -> List[BaseAgent]:
     agents = []
@@ -0,0 +1,115 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Callable, Iterable, Optional, Set
+
+
+def load_imaging_ids(path: str) -> List[str]:
+    """从文件读取影像号，每行一个，忽略空行和 # 开头的注释。"""
+    ids = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                ids.append(line)
+    return ids
+
+
+def parse_id_range(spec: str) -> List[str]:
+    """解析 '起始-结束' 形式的影像号范围（包含两端），例如 '10578900-10579000'。"""
+    start, _, end = spec.partition('-')
+    if not end:
+        raise ValueError(f"无效的影像号范围: {spec}，应为 '起始-结束'")
+    start, end = int(start), int(end)
+    if end < start:
+        raise ValueError(f"无效的影像号范围: {spec}，结束值小于起始值")
+    return [str(i) for i in range(start, end + 1)]
+
+
+class BatchCheckpoint:
+    """
+    批处理断点记录：每处理完一个影像号就追加一行 JSON，中断后重跑时跳过已完成的影像号。
+    scope 标识一次批处理的内容（例如对患者提出的问题），只有 scope 相同的记录才算已完成，
+    因此同一个断点文件可以被不同问题的批处理共用。
+    """
+    def __init__(self, path: str, scope: Optional[str] = None):
+        self.path = path
+        self.scope = scope
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def completed(self) -> Set[str]:
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 进程被杀死时最后一行可能不完整
+                # 失败的影像号不算完成，下次继续重试；其他 scope 的记录不算本次的进度
+                if entry.get("status") != "error" and entry.get("scope") == self.scope:
+                    done.add(str(entry["imaging_id"]))
+        return done
+
+    def record(self, imaging_id: str, status: str, **extra: Any) -> None:
+        entry = {"imaging_id": imaging_id, "status": status, "scope": self.scope, "time": time.time(), **extra}
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+
+
+def run_batch(
+    imaging_ids: Iterable[str],
+    process_fn: Callable[[str], str],
+    checkpoint: BatchCheckpoint,
+    max_workers: int = 1,
+    fresh: bool = False
+) -> Dict[str, Any]:
+    """
+    用有界线程池批量处理影像号。process_fn 返回状态字符串（如 'done'、'missing'），抛出异常视为失败。
+    fresh 为 True 时忽略断点中已有的记录，全部重新处理。按 Ctrl+C 时取消尚未开始的影像号，
+    只等待正在处理的完成。返回处理统计，并打印吞吐量（患者/分钟）。
+    """
+    done = set() if fresh else checkpoint.completed()
+    unique_ids = list(dict.fromkeys(str(i) for i in imaging_ids))
+    pending = [i for i in unique_ids if i not in done]
+    print(f"批处理: 共 {len(unique_ids)} 个影像号，已完成 {len(unique_ids) - len(pending)} 个，本次待处理 {len(pending)} 个")
+
+    counts = {"done": 0, "missing": 0, "error": 0}
+    started = time.time()
+
+    def _process(imaging_id: str) -> str:
+        try:
+            status = process_fn(imaging_id)
+        except Exception as e:
+            print(f"影像号 {imaging_id} 处理失败: {e}")
+            checkpoint.record(imaging_id, "error", error=str(e))
+            return "error"
+        checkpoint.record(imaging_id, status)
+        return status
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    try:
+        futures = [executor.submit(_process, imaging_id) for imaging_id in pending]
+        for future in as_completed(futures):
+            status = future.result()
+            counts[status] = counts.get(status, 0) + 1
+    except KeyboardInterrupt:
+        print(f"\n批处理被中断: 已处理 {sum(counts.values())} 个，取消尚未开始的影像号，等待正在处理的完成...")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    elapsed = time.time() - started
+    per_minute = counts["done"] / elapsed * 60 if elapsed > 0 else 0.0
+    summary = {**counts, "elapsed_seconds": elapsed, "patients_per_minute": per_minute}
+    print(f"批处理完成: 成功 {counts['done']}，未找到 {counts['missing']}，失败 {counts['error']}，"
+          f"耗时 {elapsed:.1f} 秒，吞吐量 {per_minute:.2f} 患者/分钟")
+    return summary
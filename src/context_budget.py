@@ -0,0 +1,112 @@
+import threading
+from typing import List, Dict, Any, Callable, Optional
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def get_encoding():
+    """共享的 tiktoken 编码器（cl100k_base），首次使用时加载。"""
+    global _encoding
+    with _encoding_lock:
+        if _encoding is None:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        return _encoding
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """把文本截断到 max_tokens 个 token 以内，截断时在末尾标注。"""
+    encoding = get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + "...(已压缩)"
+
+
+class TokenLedger:
+    """
+    统计一次运行中上下文压缩节省的 token：naive 为旧做法（完整拼接全部内容）的 token 数，sent 为实际发送的 token 数。
+    """
+    def __init__(self):
+        self.naive = 0
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def record(self, naive: int, sent: int) -> None:
+        with self._lock:
+            self.naive += naive
+            self.sent += sent
+
+    @property
+    def saved(self) -> int:
+        return self.naive - self.sent
+
+    def summary(self) -> str:
+        ratio = self.saved / self.naive if self.naive else 0.0
+        return f"上下文 token: 原始 {self.naive}，实际发送 {self.sent}，节省 {self.saved} ({ratio:.1%})"
+
+
+class StepContext:
+    """
+    Worker 链的上下文：原始数据只保留一份，之前步骤的结果按 token 预算组装。
+    超出预算时，最近 keep_recent 个步骤保留全文，更早的步骤压缩到 compress_tokens 个 token
+    （可传入 summarizer 代替截断），仍超出预算时从最早的步骤开始省略。
+    """
+    def __init__(
+        self,
+        base: str,
+        keep_recent: int = 2,
+        compress_tokens: int = 200,
+        summarizer: Optional[Callable[[str, int], str]] = None,
+        ledger: Optional[TokenLedger] = None
+    ):
+        self.base = base
+        self.base_tokens = count_tokens(base)
+        self.keep_recent = keep_recent
+        self.compress_tokens = compress_tokens
+        self.summarizer = summarizer or truncate_tokens
+        self.ledger = ledger
+        self.steps: List[Dict[str, Any]] = []
+
+    def add(self, step_name: str, result: str) -> None:
+        text = f"\n\n步骤 '{step_name}' 的已完成结果:\n{result}"
+        self.steps.append({"text": text, "tokens": count_tokens(text), "compressed": None})
+
+    def _compressed(self, step: Dict[str, Any]) -> str:
+        if step["compressed"] is None:
+            # 压缩结果只计算一次，后续步骤直接复用
+            if step["tokens"] <= self.compress_tokens:
+                step["compressed"] = step["text"]
+            else:
+                step["compressed"] = self.summarizer(step["text"], self.compress_tokens)
+        return step["compressed"]
+
+    def render(self, budget: Optional[int] = None) -> str:
+        """按预算组装上下文；未超出预算（或 budget 为 None）时保留全部结果原文。"""
+        parts = [step["text"] for step in self.steps]
+        sizes = [step["tokens"] for step in self.steps]
+        total = self.base_tokens + sum(sizes)
+
+        dropped = 0
+        if budget is not None and total > budget:
+            # 超出预算：先压缩较早的步骤，仍然超出时从最早的步骤开始省略
+            for i in range(max(0, len(self.steps) - self.keep_recent)):
+                parts[i] = self._compressed(self.steps[i])
+                total -= sizes[i]
+                sizes[i] = count_tokens(parts[i])
+                total += sizes[i]
+            while total > budget and dropped < len(parts) - 1:
+                total -= sizes[dropped]
+                dropped += 1
+        if dropped:
+            parts = [f"\n\n(已省略前 {dropped} 个步骤的结果)"] + parts[dropped:]
+
+        context = self.base + "".join(parts)
+        if self.ledger is not None:
+            self.ledger.record(self.base_tokens + sum(step["tokens"] for step in self.steps), count_tokens(context))
+        return context
@@ -0,0 +1,82 @@
+import json
+import os
+import socket
+import socketserver
+import stat
+from typing import Any, Callable, Dict, Tuple, Union
+
+# 本地套接字地址：支持 Unix 域套接字时为文件路径，否则为 ("127.0.0.1", 端口)
+Address = Union[str, Tuple[str, int]]
+
+def resolve_address(socket_path: str, port: int) -> Address:
+    return socket_path if hasattr(socket, "AF_UNIX") else ("127.0.0.1", port)
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    # 每行一个 JSON 请求，每个请求回复一行 JSON；同一连接可以连续发送多个请求
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = self.server.dispatch(json.loads(line))
+            except Exception as e:
+                response = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+def _remove_stale_socket(path: str) -> None:
+    # 上次异常退出会留下套接字文件；只有确认没有进程在监听时才删除，避免抢占正在运行的守护进程
+    if not os.path.exists(path):
+        return
+    if not stat.S_ISSOCK(os.stat(path).st_mode):
+        raise RuntimeError(f"{path} 已存在且不是套接字文件，拒绝覆盖")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(path)
+            return
+    raise RuntimeError(f"已有守护进程在 {path} 上运行")
+
+def _make_server(address: Address, handle_request: Callable[[Dict[str, Any]], Dict[str, Any]]) -> socketserver.BaseServer:
+    if isinstance(address, str):
+        _remove_stale_socket(address)
+        directory = os.path.dirname(address)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        server = socketserver.ThreadingUnixStreamServer(address, _RequestHandler)
+    else:
+        server = socketserver.ThreadingTCPServer(address, _RequestHandler)
+    server.daemon_threads = True
+    server.dispatch = handle_request  # 不能叫 handle_request，那会覆盖 BaseServer.handle_request
+    return server
+
+def serve(address: Address, handle_request: Callable[[Dict[str, Any]], Dict[str, Any]]) -> None:
+    """
+    在本地套接字上常驻服务，直到 Ctrl+C。handle_request 在各连接的线程中并发调用，
+    抛出的异常作为 {"status": "error"} 回复给客户端。
+    """
+    server = _make_server(address, handle_request)
+    print(f"守护进程已启动: {address}（Ctrl+C 退出）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if isinstance(address, str) and os.path.exists(address):
+            os.remove(address)
+
+def send_request(address: Address, request: Dict[str, Any], timeout: float = None) -> Dict[str, Any]:
+    """向守护进程发送一个请求并等待回复。守护进程未启动时抛出 OSError。"""
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        with sock.makefile("rwb") as stream:
+            stream.write((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+            stream.flush()
+            line = stream.readline()
+    if not line:
+        raise ConnectionError("守护进程没有返回结果")
+    return json.loads(line)
@@ -1,27 +1,129 @@
-import pandas as pd
 import os
+import threading
+
+ID_COLUMN = '影像号'
+
+
+def _default_data_file():
+    # 自动定位到项目根目录下的 data 文件夹
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_dir, 'data', 'Thymus_data.csv')
+
+
+class PatientStore:
+    """
+    患者数据仓库：只加载一次 CSV，并在影像号上建立哈希索引，支持 O(1) 查找。
+    CSV 的修改时间变化后自动重新加载；如果安装了 pyarrow，会在旁边生成 Feather 列式缓存以加速冷启动。
+    """
+    def __init__(self, data_file=None, use_columnar_cache=True):
+        self.data_file = os.path.abspath(data_file or _default_data_file())
+        self.cache_file = self.data_file + '.feather'
+        self.use_columnar_cache = use_columnar_cache
+        # (DataFrame, 影像号索引, CSV 修改时间) 作为一个整体发布，无锁读取时不会拿到不配套的两半
+        self._loaded = None
+        self._lock = threading.Lock()
+
+    def _read_columnar_cache(self, mtime):
+        # 缓存文件比 CSV 新时才可用
+        if not self.use_columnar_cache or not os.path.exists(self.cache_file):
+            return None
+        if os.path.getmtime(self.cache_file) < mtime:
+            return None
+        import pandas as pd  # pandas 导入较慢，第一次加载数据时才导入
+        try:
+            return pd.read_feather(self.cache_file)
+        except Exception:
+            return None  # 未安装 pyarrow 或缓存损坏时退回读取 CSV
+
+    def _write_columnar_cache(self, df):
+        if not self.use_columnar_cache:
+            return
+        try:
+            df.to_feather(self.cache_file)
+        except Exception:
+            # 缓存只是加速手段，写入失败（缺少 pyarrow、混合类型列、只读目录等）时忽略
+            if os.path.exists(self.cache_file):
+                try:
+                    os.remove(self.cache_file)
+                except OSError:
+                    pass
+
+    def _load(self, mtime):
+        """读取数据并建立索引，返回 (df, index)。"""
+        df = self._read_columnar_cache(mtime)
+        if df is None:
+            import pandas as pd
+            df = pd.read_csv(self.data_file, encoding='utf-8')  # 确保编码
+            self._write_columnar_cache(df)
+
+        # 影像号统一按字符串建立索引，重复时保留第一条（与原先的行为一致）
+        index = {}
+        for position, key in enumerate(df[ID_COLUMN].astype(str)):
+            index.setdefault(key, position)
+
+        return df, index
+
+    def _ensure_loaded(self):
+        mtime = os.path.getmtime(self.data_file)
+        loaded = self._loaded  # 只读取一次属性，重新加载同时进行也不会混用新旧数据
+        if loaded is not None and loaded[2] == mtime:
+            return loaded[0], loaded[1]
+        with self._lock:
+            loaded = self._loaded
+            if loaded is None or loaded[2] != mtime:
+                df, index = self._load(mtime)
+                loaded = self._loaded = (df, index, mtime)
+            return loaded[0], loaded[1]
+
+    def get(self, imaging_id):
+        """按影像号获取单个患者的数据字典，找不到时返回 None。"""
+        df, index = self._ensure_loaded()
+        position = index.get(str(imaging_id))
+        if position is None:
+            return None
+        return df.iloc[[position]].to_dict('records')[0]  # 返回行数据字典
+
+    def get_many(self, imaging_ids):
+        """批量获取患者数据，返回 {影像号: 数据字典}，找不到的影像号对应 None。"""
+        df, index = self._ensure_loaded()
+        keys = [str(i) for i in imaging_ids]
+        found = [k for k in keys if k in index]
+        records = df.iloc[[index[k] for k in found]].to_dict('records') if found else []
+        result = dict.fromkeys(keys)
+        result.update(zip(found, records))
+        return result
+
+    def __len__(self):
+        return len(self._ensure_loaded()[1])
+
+    def __contains__(self, imaging_id):
+        return str(imaging_id) in self._ensure_loaded()[1]
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_patient_store(data_file=None):
+    """获取进程内共享的 PatientStore，同一个数据文件只加载一次。"""
+    path = os.path.abspath(data_file or _default_data_file())
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store = PatientStore(path)
+            _stores[path] = store
+        return store
+
 
 def get_patient_data(imaging_id, data_file=None):
-    if data_file is None:
-        # 自动定位到项目根目录下的 data 文件夹
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        data_file = os.path.join(base_dir, 'data', 'Thymus_data.csv')
-    df = pd.read_csv(data_file, encoding='utf-8')  # 确保编码
-    
-    # 尝试转换为字符串匹配
-    patient_row = df[df['影像号'].astype(str) == str(imaging_id)]
-    
-    if patient_row.empty:
-        return None
-    
-    return patient_row.to_dict('records')[0]  # 返回行数据字典
+    return get_patient_store(data_file).get(imaging_id)
 
 # 新增函数：输出读取到的前五列数据（假设有患者数据）
 def print_first_five_columns(patient_data):
     if patient_data is None:
         print("无患者数据可供显示")
         return
-    
+
     # 获取前五列的键
     columns = list(patient_data.keys())[:5]  # 前五列：影像号, 是否有病理, 是否出组, 症状, 病理诊断
     print("前五列数据：")
@@ -0,0 +1,83 @@
+import threading
+from typing import TYPE_CHECKING, Dict, Any, Tuple
+
+if TYPE_CHECKING:
+    import httpx
+    from openai import OpenAI, AsyncOpenAI
+
+# openai 和 httpx 导入较慢，在第一次创建客户端时才导入
+
+# 进程内共享的客户端注册表，按 (base_url, api_key) 区分
+_clients: Dict[Tuple[str, str], "OpenAI"] = {}
+_async_clients: Dict[Tuple[str, str], "AsyncOpenAI"] = {}
+_lock = threading.Lock()
+
+
+def _client_key(llm_config: Dict[str, Any]) -> Tuple[str, str]:
+    return (llm_config["base_url"], llm_config["api_key"])
+
+
+def _pool_limits(llm_config: Dict[str, Any]) -> "httpx.Limits":
+    import httpx
+    from openai import DEFAULT_CONNECTION_LIMITS
+
+    # 并发调用数是 batch.max_workers × max_concurrency × max_step_concurrency 的乘积，常驻模式下还没有上限；
+    # 连接池小于并发数时，等待空闲连接的时间会计入请求超时，造成误报的超时和重试。
+    # 因此默认沿用 openai 的连接上限，并发由线程池和 llm_scheduler 控制；需要时可用 max_connections 收紧
+    max_connections = llm_config.get("max_connections")
+    return httpx.Limits(
+        max_connections=max_connections or DEFAULT_CONNECTION_LIMITS.max_connections,
+        max_keepalive_connections=max_connections or DEFAULT_CONNECTION_LIMITS.max_keepalive_connections,
+        keepalive_expiry=float(llm_config.get("keepalive_expiry", 60))
+    )
+
+
+def _client_options(llm_config: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "api_key": llm_config["api_key"],
+        "base_url": llm_config["base_url"],
+        "timeout": llm_config.get("timeout", 30),
+        # 重试由 llm_scheduler 统一负责（max_attempts、退避和限流），客户端自身不再重试
+        "max_retries": 0
+    }
+
+
+def get_client(llm_config: Dict[str, Any]) -> "OpenAI":
+    """
+    获取共享的 OpenAI 客户端。相同 (base_url, api_key) 的 Agent 复用同一个 keep-alive 连接池。
+    """
+    key = _client_key(llm_config)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            from openai import OpenAI, DefaultHttpxClient
+            client = OpenAI(
+                http_client=DefaultHttpxClient(limits=_pool_limits(llm_config)),
+                **_client_options(llm_config)
+            )
+            _clients[key] = client
+        return client
+
+
+def get_async_client(llm_config: Dict[str, Any]) -> "AsyncOpenAI":
+    """获取共享的 AsyncOpenAI 客户端，供 asyncio 代码使用。"""
+    key = _client_key(llm_config)
+    with _lock:
+        client = _async_clients.get(key)
+        if client is None:
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            client = AsyncOpenAI(
+                http_client=DefaultAsyncHttpxClient(limits=_pool_limits(llm_config)),
+                **_client_options(llm_config)
+            )
+            _async_clients[key] = client
+        return client
+
+
+def close_clients() -> None:
+    """关闭所有同步客户端的连接池（异步客户端需在事件循环内自行 close）。"""
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+        _async_clients.clear()
@@ -0,0 +1,245 @@
+import random
+import threading
+import time
+from typing import Dict, Any, Callable, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class LLMError(Exception):
+    """LLM 调用失败的基类。"""
+
+
+class LLMRateLimitError(LLMError):
+    """多次重试后仍被限流（429）。"""
+
+
+class LLMTimeoutError(LLMError):
+    """超过单次调用的截止时间（包括排队和重试的时间）。"""
+
+
+class LLMCircuitOpenError(LLMError):
+    """熔断器处于打开状态，暂停向服务商发送请求。"""
+
+
+class LLMRequestError(LLMError):
+    """不可重试的错误（如参数错误、鉴权失败），或重试次数耗尽后的其他错误。"""
+
+
+class TokenBucket:
+    """
+    令牌桶：每分钟补充 rate_per_minute 个令牌，最多累积 capacity 个。
+    """
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float, deadline: float) -> None:
+        """阻塞直到取得 amount 个令牌；到 deadline（time.monotonic）仍未取得时抛出 LLMTimeoutError。"""
+        amount = min(amount, self.capacity)  # 超过桶容量的请求最多等到桶满
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            if now + wait > deadline:
+                raise LLMTimeoutError("等待速率限制配额超时")
+            time.sleep(wait)
+
+    def refund(self, amount: float) -> None:
+        """归还多预留的令牌（例如实际使用的 token 少于预估值）。"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class CircuitBreaker:
+    """
+    熔断器：连续 failure_threshold 次可重试的失败后打开，reset_timeout 秒后进入半开状态，
+    只放行一个试探请求，其余请求在试探有结果前仍被拒绝。试探成功则关闭，失败则重新打开。
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False  # 半开状态下是否已有试探请求在进行
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if self.probing:
+                raise LLMCircuitOpenError(f"连续失败 {self.failures} 次，熔断中（等待试探请求的结果）")
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise LLMCircuitOpenError(f"连续失败 {self.failures} 次，熔断中")
+            self.probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release_probe(self) -> None:
+        """试探请求没有得出结论（排队超时、不可重试的错误）时调用，让下一个请求重新试探。"""
+        with self._lock:
+            self.probing = False
+
+
+def _classify(error: Exception) -> Tuple[str, bool]:
+    """返回 (错误类别, 是否可重试)。"""
+    import openai  # 只在出错时需要；模块导入时不加载 openai
+
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limit", True
+    if isinstance(error, openai.APITimeoutError):
+        return "timeout", True
+    if isinstance(error, openai.APIConnectionError):
+        return "connection", True
+    if isinstance(error, openai.APIStatusError):
+        return "status", error.status_code in (408, 409) or error.status_code >= 500
+    return "other", False
+
+
+# 重试耗尽或无法重试时，按错误类别抛出的异常类型
+_ERROR_CLASSES = {"rate_limit": LLMRateLimitError, "timeout": LLMTimeoutError}
+
+
+def to_llm_error(error: Exception) -> LLMError:
+    """把调度器之外出现的异常（例如读取流式响应时连接中断）转换为对应的 LLMError 子类。"""
+    if isinstance(error, LLMError):
+        return error
+    kind, _ = _classify(error)
+    return _ERROR_CLASSES.get(kind, LLMRequestError)(f"读取流式响应时失败: {type(error).__name__}: {error}")
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    """
+    所有 Agent 共享的 LLM 请求调度器：按每分钟请求数（RPM）和 token 数（TPM）限流，
+    指数退避加随机抖动重试，单次调用有总截止时间，连续失败时熔断。失败以 LLMError 子类抛出。
+    """
+    def __init__(
+        self,
+        rpm: float = 60,
+        tpm: float = 100000,
+        max_attempts: int = 5,
+        deadline: float = 120.0,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        circuit_failures: int = 5,
+        circuit_reset: float = 60.0
+    ):
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+        self.max_attempts = max(1, max_attempts)
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(circuit_failures, circuit_reset)
+
+    def call(self, fn: Callable[[float], T], estimated_tokens: int = 0, stats: Optional[Dict[str, Any]] = None) -> T:
+        """
+        执行 fn(timeout)，timeout 为距截止时间的剩余秒数。stats 会累计排队时间（queue_time）和重试次数（retries）。
+        """
+        if stats is not None:
+            stats.setdefault("queue_time", 0.0)
+            stats.setdefault("retries", 0)
+        deadline_at = time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            queued = time.monotonic()
+            try:
+                self.request_bucket.acquire(1, deadline_at)
+                self.token_bucket.acquire(estimated_tokens, deadline_at)
+            except LLMTimeoutError:
+                self.breaker.release_probe()
+                raise
+            now = time.monotonic()
+            if stats is not None:
+                stats["queue_time"] += now - queued
+
+            try:
+                result = fn(deadline_at - now)
+            except Exception as e:
+                # 失败的请求没有消耗 TPM 配额；每次重试都会重新预留，这里归还本次的预留
+                self.token_bucket.refund(estimated_tokens)
+                kind, retryable = _classify(e)
+                if not retryable:
+                    self.breaker.release_probe()
+                    raise LLMRequestError(str(e)) from e
+                self.breaker.record_failure()
+                attempt += 1
+                if attempt >= self.max_attempts:
+                    error_class = _ERROR_CLASSES.get(kind, LLMRequestError)
+                    raise error_class(f"重试 {attempt} 次后仍然失败: {e}") from e
+                # 指数退避 + 全抖动；服务商给出 Retry-After 时至少等待该时长
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+                delay = max(delay, _retry_after(e) or 0.0)
+                if time.monotonic() + delay >= deadline_at:
+                    raise LLMTimeoutError(f"重试等待将超过截止时间: {e}") from e
+                if stats is not None:
+                    stats["retries"] += 1
+                time.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    def settle_tokens(self, estimated_tokens: int, actual_tokens: Optional[int]) -> None:
+        """调用完成后按实际用量归还多预留的 TPM 配额。"""
+        if actual_tokens is not None and actual_tokens < estimated_tokens:
+            self.token_bucket.refund(estimated_tokens - actual_tokens)
+
+
+_schedulers: Dict[Tuple[str, str], RequestScheduler] = {}
+_lock = threading.Lock()
+
+
+def get_scheduler(llm_config: Dict[str, Any]) -> RequestScheduler:
+    """获取共享的调度器；相同 (base_url, api_key) 的 Agent 共用同一份配额。"""
+    key = (llm_config["base_url"], llm_config["api_key"])
+    with _lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = RequestScheduler(
+                rpm=llm_config.get("rpm", 60),
+                tpm=llm_config.get("tpm", 100000),
+                max_attempts=llm_config.get("max_attempts", 5),
+                deadline=llm_config.get("deadline", 120),
+                backoff_base=llm_config.get("backoff_base", 1.0),
+                backoff_max=llm_config.get("backoff_max", 30.0),
+                circuit_failures=llm_config.get("circuit_failures", 5),
+                circuit_reset=llm_config.get("circuit_reset", 60)
+            )
+            _schedulers[key] = scheduler
+        return scheduler
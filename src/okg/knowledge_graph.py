@@ -1,63 +1,147 @@
-import requests
-import rdflib
-from rdflib import Graph, URIRef, Literal, Namespace
-import xml.etree.ElementTree as ET  # 添加导入
+import weakref
+from okg.pubmed_cache import settings, get_store, eutils_get, eutils_post
+from okg.text_index import TextIndex
 
-# 定义命名空间
-MED = Namespace("http://example.org/medical/")
+# rdflib 和 xml.etree 在第一次构建图谱 / 解析下载结果时才导入，只查本地缓存或跳过知识检索时不加载
+
+# 命名空间
+MED_NAMESPACE = "http://example.org/medical/"
+
+# 每个图谱对应的全文倒排索引，随图谱一起回收
+_graph_indexes = weakref.WeakKeyDictionary()
+
+def _cache_ttl():
+    # 离线模式下过期的缓存也照常使用
+    return None if settings["offline"] else settings["ttl"]
 
 def fetch_pubmed_data(query, max_results=10):
-    """从 PubMed API 获取数据"""
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
+    """从 PubMed API 获取数据（优先使用本地缓存）"""
+    store = get_store()
+    ids = store.get_search(query, max_results, _cache_ttl())
+    if ids is not None:
+        return ids
+    if settings["offline"]:
+        print(f"警告: 离线模式下本地缓存中没有检索词 '{query}' 的结果")
+        return []
+
     params = {
         "db": "pubmed",
         "term": query,
         "retmax": max_results,
         "retmode": "json"
     }
-    response = requests.get(base_url, params=params)
+    response = eutils_get("esearch.fcgi", params)
     data = response.json()
-    return data.get("esearchresult", {}).get("idlist", [])
+    ids = data.get("esearchresult", {}).get("idlist", [])
+    store.put_search(query, max_results, ids)
+    return ids
 
-def fetch_pubmed_details(pubmed_ids):
-    """获取文章详情"""
-    base_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
-    params = {
-        "db": "pubmed",
-        "id": ",".join(pubmed_ids),
-        "retmode": "xml"
-    }
-    response = requests.get(base_url, params=params)
-    root = ET.fromstring(response.text)
+def _parse_articles(xml_text):
+    """解析 efetch 返回的 XML，按 PMID 返回文章详情"""
+    import xml.etree.ElementTree as ET
+    root = ET.fromstring(xml_text)
     details = []
     for article in root.findall(".//PubmedArticle"):
+        pmid_elem = article.find(".//MedlineCitation/PMID")
         title_elem = article.find(".//ArticleTitle")
         abstract_elem = article.find(".//AbstractText")
+        if pmid_elem is None or not pmid_elem.text:
+            continue
         title = title_elem.text if title_elem is not None else "No Title"
         abstract = abstract_elem.text if abstract_elem is not None else "No Abstract"
-        details.append({"title": title, "abstract": abstract})
-    return details  # 返回详情列表
+        details.append({"pmid": pmid_elem.text.strip(), "title": title, "abstract": abstract})
+    return details
+
+def _download_details(pubmed_ids):
+    """从网络下载文章详情；ID 较多时先 EPost 到历史服务器，再分批 efetch"""
+    batch_size = settings["batch_size"]
+    if len(pubmed_ids) <= settings["epost_threshold"]:
+        details = []
+        for start in range(0, len(pubmed_ids), batch_size):
+            params = {
+                "db": "pubmed",
+                "id": ",".join(pubmed_ids[start:start + batch_size]),
+                "retmode": "xml"
+            }
+            details.extend(_parse_articles(eutils_get("efetch.fcgi", params).text))
+        return details
+
+    import xml.etree.ElementTree as ET
+    post = ET.fromstring(eutils_post("epost.fcgi", {"db": "pubmed", "id": ",".join(pubmed_ids)}).text)
+    web_env = post.findtext("WebEnv")
+    query_key = post.findtext("QueryKey")
+    details = []
+    for start in range(0, len(pubmed_ids), batch_size):
+        params = {
+            "db": "pubmed",
+            "WebEnv": web_env,
+            "query_key": query_key,
+            "retstart": start,
+            "retmax": batch_size,
+            "retmode": "xml"
+        }
+        details.extend(_parse_articles(eutils_get("efetch.fcgi", params).text))
+    return details
+
+def fetch_pubmed_details(pubmed_ids):
+    """获取文章详情（优先使用本地缓存，只下载缺失或过期的文章）"""
+    pubmed_ids = [str(pid) for pid in pubmed_ids]
+    store = get_store()
+    cached = store.get_articles(pubmed_ids, _cache_ttl())
+    missing = [pid for pid in pubmed_ids if pid not in cached]
+    if missing:
+        if settings["offline"]:
+            print(f"警告: 离线模式下本地缓存中缺少 {len(missing)} 篇文章")
+        else:
+            downloaded = _download_details(missing)
+            store.put_articles(downloaded)
+            cached.update({d["pmid"]: d for d in downloaded})
+    return [cached[pid] for pid in pubmed_ids if pid in cached]  # 返回详情列表，顺序与输入一致
+
+def get_graph_index(graph):
+    """获取图谱的全文索引，不存在时为其中已有的三元组建立索引"""
+    index = _graph_indexes.get(graph)
+    if index is None:
+        index = TextIndex()
+        for s, p, o in graph:
+            index.add(str(s), str(p), str(o))
+        _graph_indexes[graph] = index
+    return index
+
+def add_articles_to_graph(graph, details):
+    """向图谱中添加文章，并同步更新全文索引（增量）"""
+    from rdflib import URIRef, Literal, Namespace
+    med = Namespace(MED_NAMESPACE)
+    index = get_graph_index(graph)
+    for detail in details:
+        article_uri = URIRef(f"http://pubmed.ncbi.nlm.nih.gov/{detail['pmid']}/")
+        for predicate, text in ((med.hasTitle, detail['title']), (med.hasAbstract, detail['abstract'])):
+            graph.add((article_uri, predicate, Literal(text)))
+            index.add(str(article_uri), str(predicate), str(text))
+    return graph
 
 def build_knowledge_graph(pubmed_ids):
     """构建简单知识图谱"""
+    from rdflib import Graph
     g = Graph()
     details = fetch_pubmed_details(pubmed_ids)  # 获取详情
-    for pid, detail in zip(pubmed_ids, details):
-        article_uri = URIRef(f"http://pubmed.ncbi.nlm.nih.gov/{pid}/")
-        g.add((article_uri, MED.hasTitle, Literal(detail['title'])))
-        g.add((article_uri, MED.hasAbstract, Literal(detail['abstract'])))
-    return g
-
-def query_knowledge_graph(graph, query_term):
-    """查询图谱中与查询词相关的文章"""
-    results = []
-    for s, p, o in graph:
-        if query_term.lower() in str(o).lower():  # 简单文本匹配
-            results.append((str(s), str(p), str(o)))
-    return results
+    return add_articles_to_graph(g, details)
+
+def query_knowledge_graph(graph, query_term, top_k=None):
+    """查询图谱中与查询词相关的文章，按相关度排序；top_k 为 None 时返回全部匹配项"""
+    return get_graph_index(graph).search(query_term, top_k)
+
+def format_snippets(results, max_chars=500):
+    """把查询结果整理成简短的文本片段，供注入到提示词中"""
+    snippets = []
+    for s, p, o in results:
+        field = p.rsplit('/', 1)[-1]
+        text = o if len(o) <= max_chars else o[:max_chars] + "..."
+        snippets.append(f"- [{field}] {s}\n  {text}")
+    return "\n".join(snippets)
 
 # 示例使用
 if __name__ == "__main__":
     ids = fetch_pubmed_data("thymoma", max_results=5)  # 修改查询词为胸腺瘤
     graph = build_knowledge_graph(ids)
-    print(graph.serialize(format="turtle"))  # 输出图谱
\ No newline at end of file
+    print(graph.serialize(format="turtle"))  # 输出图谱
@@ -0,0 +1,145 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
+
+if TYPE_CHECKING:
+    import requests
+
+# 默认的本地缓存位置：项目根目录下的 cache/pubmed.sqlite
+_DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'cache', 'pubmed.sqlite'
+)
+
+# 运行配置，可通过 configure_pubmed 或环境变量修改
+settings = {
+    # E-utilities 地址，可指向本地的替身服务器
+    "base_url": os.getenv("PUBMED_EUTILS_URL", "https://eutils.ncbi.nlm.nih.gov/entrez/eutils"),
+    "cache_path": os.getenv("PUBMED_CACHE_PATH", _DEFAULT_CACHE_PATH),
+    "ttl": 30 * 24 * 3600,  # 缓存有效期（秒），过期后重新请求
+    "offline": os.getenv("PUBMED_OFFLINE", "") == "1",  # 离线模式：只读缓存，不发起任何 HTTP 请求
+    "timeout": 30,
+    "epost_threshold": 200,  # ID 数量超过该值时先 EPost 再按历史服务器分批获取
+    "batch_size": 200
+}
+
+_store = None
+_session = None
+_lock = threading.Lock()
+
+
+def configure_pubmed(**options: Any) -> None:
+    """修改 PubMed 访问配置（base_url、cache_path、ttl、offline 等），并重置缓存连接。"""
+    global _store
+    unknown = set(options) - set(settings)
+    if unknown:
+        raise ValueError(f"未知的 PubMed 配置项: {sorted(unknown)}")
+    with _lock:
+        settings.update({k: v for k, v in options.items() if v is not None})
+        _store = None
+
+
+class PubmedStore:
+    """
+    PubMed 本地持久化缓存：检索结果按 (检索词, 数量) 存储，文章详情按 PMID 存储。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS searches ("
+            "term TEXT NOT NULL, retmax INTEGER NOT NULL, ids TEXT NOT NULL, fetched_at REAL NOT NULL, "
+            "PRIMARY KEY (term, retmax))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS articles ("
+            "pmid TEXT PRIMARY KEY, title TEXT, abstract TEXT, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _fresh(fetched_at: float, ttl: Optional[float]) -> bool:
+        return ttl is None or time.time() - fetched_at <= ttl
+
+    def get_search(self, term: str, retmax: int, ttl: Optional[float]) -> Optional[List[str]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ids, fetched_at FROM searches WHERE term = ? AND retmax = ?", (term, retmax)
+            ).fetchone()
+        if row is None or not self._fresh(row[1], ttl):
+            return None
+        return json.loads(row[0])
+
+    def put_search(self, term: str, retmax: int, ids: List[str]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO searches (term, retmax, ids, fetched_at) VALUES (?, ?, ?, ?)",
+                (term, retmax, json.dumps(ids), time.time())
+            )
+            self._conn.commit()
+
+    def get_articles(self, pmids: List[str], ttl: Optional[float]) -> Dict[str, Dict[str, str]]:
+        """返回缓存中仍然有效的文章 {pmid: 详情}。"""
+        found = {}
+        with self._lock:
+            # 分批查询，避免超过 SQLite 的参数数量上限
+            for start in range(0, len(pmids), 500):
+                chunk = pmids[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT pmid, title, abstract, fetched_at FROM articles WHERE pmid IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for pmid, title, abstract, fetched_at in rows:
+                    if self._fresh(fetched_at, ttl):
+                        found[pmid] = {"pmid": pmid, "title": title, "abstract": abstract}
+        return found
+
+    def put_articles(self, details: List[Dict[str, str]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO articles (pmid, title, abstract, fetched_at) VALUES (?, ?, ?, ?)",
+                [(d["pmid"], d["title"], d["abstract"], now) for d in details]
+            )
+            self._conn.commit()
+
+
+def get_store() -> PubmedStore:
+    global _store
+    with _lock:
+        if _store is None:
+            _store = PubmedStore(settings["cache_path"])
+        return _store
+
+
+def get_session() -> "requests.Session":
+    """进程内共享的 requests.Session，复用 keep-alive 连接。requests 在第一次联网时才导入。"""
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def eutils_get(endpoint: str, params: Dict[str, Any]) -> "requests.Response":
+    response = get_session().get(f"{settings['base_url']}/{endpoint}", params=params, timeout=settings["timeout"])
+    response.raise_for_status()
+    return response
+
+
+def eutils_post(endpoint: str, data: Dict[str, Any]) -> "requests.Response":
+    response = get_session().post(f"{settings['base_url']}/{endpoint}", data=data, timeout=settings["timeout"])
+    response.raise_for_status()
+    return response
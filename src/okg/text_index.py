@@ -0,0 +1,78 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import List, Tuple
+
+# 英文单词/数字按词切分；连续的中文按二元组（bigram）切分，单字成词时保留单字
+_TOKEN_RE = re.compile(r"[a-z0-9]+|[一-鿿]+")
+_CJK_RE = re.compile(r"[一-鿿]")
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for match in _TOKEN_RE.findall(text.lower()):
+        if _CJK_RE.match(match):
+            if len(match) == 1:
+                tokens.append(match)
+            else:
+                tokens.extend(match[i:i + 2] for i in range(len(match) - 1))
+        else:
+            tokens.append(match)
+    return tokens
+
+
+class TextIndex:
+    """
+    内存倒排索引，按 BM25 对文档排序。每个文档对应知识图谱中的一条三元组 (s, p, o)。
+    支持增量添加，查询可包含多个中英文词。中文另外按单字建索引，单字查询（例如 "瘤"）也能匹配。
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.docs: List[Tuple[str, str, str]] = []
+        self.doc_lengths: List[int] = []
+        self.postings = defaultdict(dict)  # token -> {doc_id: 词频}
+        self.char_postings = defaultdict(dict)  # 中文单字 -> {doc_id: 字频}，只用于单字查询
+        self.total_length = 0
+        self._lock = threading.Lock()
+
+    def add(self, subject: str, predicate: str, text: str) -> None:
+        tokens = tokenize(text)
+        with self._lock:
+            doc_id = len(self.docs)
+            self.docs.append((subject, predicate, text))
+            self.doc_lengths.append(len(tokens))
+            self.total_length += len(tokens)
+            for token, freq in Counter(tokens).items():
+                self.postings[token][doc_id] = freq
+            for char, freq in Counter(_CJK_RE.findall(text)).items():
+                self.char_postings[char][doc_id] = freq
+
+    def search(self, query: str, top_k: int = None) -> List[Tuple[str, str, str]]:
+        """返回与查询最相关的三元组，按相关度从高到低排序；top_k 为 None 时返回全部匹配项。"""
+        terms = set(tokenize(query))
+        with self._lock:
+            n_docs = len(self.docs)
+            if not n_docs or not terms:
+                return []
+            avg_length = self.total_length / n_docs or 1.0
+            scores = defaultdict(float)
+            for term in terms:
+                if len(term) == 1 and _CJK_RE.match(term):
+                    postings = self.char_postings.get(term)
+                else:
+                    postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, freq in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                    scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+            ranked = sorted(scores, key=lambda d: (-scores[d], d))
+            if top_k is not None:
+                ranked = ranked[:top_k]
+            return [self.docs[d] for d in ranked]
+
+    def __len__(self) -> int:
+        return len(self.docs)
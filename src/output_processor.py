@@ -1,27 +1,156 @@
 import os
-import pandas as pd
+import csv
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
 
-def process_and_save_output(imaging_id, analysis_result, reasoning_process, doctor_suggestion=None, results_dir='results/'):
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+COLUMNS = ['影像号', '推理流程', '分析结果', '医生建议']
+
+
+def _default_results_path(results_dir='results/'):
     # 自动定位到项目根目录
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    results_path = os.path.join(base_dir, results_dir)
-    os.makedirs(results_path, exist_ok=True)
-    file_path = os.path.join(results_path, f'{imaging_id}.csv')
+    return os.path.join(base_dir, results_dir)
+
+
+@contextmanager
+def _locked_append(file_path):
+    """以追加模式打开文件并加排他锁，保证多个进程/线程同时写入时不丢行。"""
+    with open(file_path, 'a', encoding='utf-8', newline='') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            f.seek(0, os.SEEK_END)
+            yield f
+            f.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class ResultSink(ABC):
+    """结果存储的基类：每次调用 write 追加一条分析记录。"""
+    @abstractmethod
+    def write(self, record):
+        """追加一条记录（包含 COLUMNS 中各列的字典）。"""
+
+
+class CsvResultSink(ResultSink):
+    """
+    每个影像号一个 CSV 文件（results/<影像号>.csv），只追加新行而不重写整个文件。
+    文件格式与之前一致。
+    """
+    def __init__(self, results_path):
+        self.results_path = results_path
+        os.makedirs(results_path, exist_ok=True)
+
+    def write(self, record):
+        file_path = os.path.join(self.results_path, f"{record['影像号']}.csv")
+        with _locked_append(file_path) as f:
+            writer = csv.writer(f, lineterminator=os.linesep)  # 与 pandas.to_csv 的默认格式一致
+            if f.tell() == 0:
+                writer.writerow(COLUMNS)  # 新文件先写表头
+            writer.writerow([record[col] for col in COLUMNS])
+
+
+class JsonlResultSink(ResultSink):
+    """每个影像号一个 JSONL 文件，每行一条记录（包含时间戳）。"""
+    def __init__(self, results_path):
+        self.results_path = results_path
+        os.makedirs(results_path, exist_ok=True)
 
+    def write(self, record):
+        file_path = os.path.join(self.results_path, f"{record['影像号']}.jsonl")
+        with _locked_append(file_path) as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+class SqliteResultSink(ResultSink):
+    """
+    所有影像号汇总到一个 SQLite 数据库中，适合批处理；在影像号和时间戳上建立索引。
+    """
+    def __init__(self, db_path):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, 影像号 TEXT NOT NULL, 时间戳 REAL NOT NULL, "
+            "推理流程 TEXT, 分析结果 TEXT, 医生建议 TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_id_time ON results(影像号, 时间戳)")
+        self._conn.commit()
+
+    def write(self, record):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO results (影像号, 时间戳, 推理流程, 分析结果, 医生建议) VALUES (?, ?, ?, ?, ?)",
+                (str(record['影像号']), record['时间戳'], record['推理流程'], record['分析结果'], record['医生建议'])
+            )
+            self._conn.commit()
+
+
+_sinks = {}
+_sinks_lock = threading.Lock()
+_configured_sink = None
+
+
+def create_sink(kind='csv', results_dir='results/'):
+    """
+    按类型创建结果存储：'csv'（默认，与旧格式兼容）、'jsonl' 或 'sqlite'（results/results.sqlite）。
+    同一类型和目录只创建一次。
+    """
+    results_path = _default_results_path(results_dir)
+    key = (kind, results_path)
+    with _sinks_lock:
+        sink = _sinks.get(key)
+        if sink is None:
+            if kind == 'csv':
+                sink = CsvResultSink(results_path)
+            elif kind == 'jsonl':
+                sink = JsonlResultSink(results_path)
+            elif kind == 'sqlite':
+                sink = SqliteResultSink(os.path.join(results_path, 'results.sqlite'))
+            else:
+                raise ValueError(f"未知的结果存储类型: {kind}")
+            _sinks[key] = sink
+        return sink
+
+
+def configure_sink(sink):
+    """设置 process_and_save_output 默认使用的结果存储；传入 None 恢复默认的 CSV。"""
+    global _configured_sink
+    _configured_sink = sink
+
+
+def process_and_save_output(imaging_id, analysis_result, reasoning_process, doctor_suggestion=None, results_dir='results/', sink=None):
     # 准备数据：影像号、推理流程、结果、医生建议
     data = {
         '影像号': imaging_id,
         '推理流程': reasoning_process,
         '分析结果': analysis_result,
-        '医生建议': doctor_suggestion or '无'
+        '医生建议': doctor_suggestion or '无',
+        '时间戳': time.time()
     }
 
-    # 如果文件存在，追加；否则创建
-    if os.path.exists(file_path):
-        df = pd.read_csv(file_path)
-        new_row = pd.DataFrame([data])
-        df = pd.concat([df, new_row], ignore_index=True)
-    else:
-        df = pd.DataFrame([data])
-
-    df.to_csv(file_path, index=False)
\ No newline at end of file
+    if sink is None:
+        sink = _configured_sink or create_sink('csv', results_dir)
+    sink.write(data)
@@ -0,0 +1,63 @@
+import string
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Chief、Manager、Worker 每次调用时拼接的提示词模板，占位符为 {name} 形式
+DEFAULT_TEMPLATES = {
+    "chief.decompose": "根据以下用户请求，将其分解为多个独立的子任务，并为每个子任务定义一个目标。请以JSON格式的列表输出，每个对象包含'task_name'和'task_description'。例如：[{{\"task_name\": \"数据分析\", \"task_description\": \"分析患者的临床数据\"}}, ...]。\n\n用户请求：\n{initial_input}",
+    "chief.summarize": "所有子任务已完成。请根据以下各子任务的总结，结合原始请求，生成最终的、完整的报告。\n\n原始请求:\n{initial_input}\n\n各子任务总结:\n{summaries}",
+    "manager.sub_task": "原始数据和问题:\n{initial_input}\n\n子任务目标: {task_description}",
+    "manager.decompose": "根据以下子任务描述，将其分解为多个具体的、可执行的工作步骤。请以JSON格式的列表输出，每个对象包含'step_name'和'step_instruction'。例如：[{{\"step_name\": \"提取关键指标\", \"step_instruction\": \"从数据中提取血压、血糖值\"}}, ...]。步骤默认按顺序执行，每一步都能看到之前所有步骤的结果；如果有些步骤彼此独立、可以同时执行，可以为每个步骤加上可选的'depends_on'，列出它需要用到其结果的前序步骤的step_name。\n\n子任务描述：\n{sub_task_description}",
+    "manager.summarize": "你已完成子任务 '{task_name}'（目标: {task_description}）。请根据以下所有工作步骤的结果，对该子任务进行总结。\n\n上下文:\n{context}",
+    "structured.json_mode": "\n\n请输出一个JSON对象，把上述列表放在 \"items\" 字段中。",
+    "structured.reask": "下面这段输出{problem}。请改正后重新输出这个JSON列表，每个对象必须包含{keys}，不要添加其他内容。\n\n输出：\n{output}",
+    "worker.execute": "请根据以下指令和上下文，完成任务并返回结果。\n\n上下文:\n{context}\n\n指令: {step_instruction}"
+}
+
+class PromptTemplate:
+    """
+    预先解析的提示词模板：构造时把文本拆成字面量和占位符，渲染时只做一次拼接。
+    """
+    __slots__ = ("name", "fields", "_parts")
+
+    def __init__(self, name: str, text: str):
+        self.name = name
+        parts: List[Tuple[str, Optional[str]]] = []
+        for literal, field, format_spec, conversion in string.Formatter().parse(text):
+            if field is not None and (not field.isidentifier() or format_spec or conversion):
+                raise ValueError(f"提示词模板 '{name}' 只支持 {{name}} 形式的占位符: {{{field}}}")
+            parts.append((literal, field))
+        self._parts = tuple(parts)
+        self.fields = frozenset(field for _, field in parts if field is not None)
+
+    def render(self, **values: object) -> str:
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError(f"提示词模板 '{self.name}' 缺少参数: {sorted(missing)}")
+        pieces = []
+        for literal, field in self._parts:
+            pieces.append(literal)
+            if field is not None:
+                value = values[field]
+                pieces.append(value if isinstance(value, str) else str(value))
+        return "".join(pieces)
+
+_templates: Dict[str, PromptTemplate] = {}
+_templates_lock = threading.Lock()
+
+def register_templates(templates: Dict[str, str]) -> None:
+    """编译并登记模板；同名模板会被替换，可用于按部署覆盖默认提示词。"""
+    compiled = {name: PromptTemplate(name, text) for name, text in templates.items()}
+    with _templates_lock:
+        _templates.update(compiled)
+
+def get_template(name: str) -> PromptTemplate:
+    try:
+        return _templates[name]
+    except KeyError:
+        raise KeyError(f"未登记的提示词模板: {name}") from None
+
+def render_prompt(name: str, **values: object) -> str:
+    return get_template(name).render(**values)
+
+register_templates(DEFAULT_TEMPLATES)
@@ -0,0 +1,110 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Dict, Any, Callable, Optional
+
+
+def _resolve_step(dep: Any, name_to_index: Dict[str, int], count: int) -> Optional[int]:
+    # 先按 step_name 匹配，再按从 1 开始的步骤序号（整数或 "2" 这样的字符串）匹配
+    if isinstance(dep, bool):
+        return None
+    if not isinstance(dep, int):
+        index = name_to_index.get(str(dep).strip())
+        if index is not None or not str(dep).strip().isdigit():
+            return index
+        dep = int(dep)
+    return dep - 1 if 1 <= dep <= count else None
+
+
+def resolve_dependencies(steps: List[Dict[str, Any]]) -> Optional[List[List[int]]]:
+    """
+    解析 Manager 输出中各步骤的 'depends_on'（依赖步骤的 step_name，或从 1 开始的步骤序号，可以是字符串）。
+    返回每个步骤所依赖的步骤下标列表；没有任何步骤声明非空的依赖、有依赖无法解析、或依赖中有环时返回 None，
+    表示按原来的顺序链执行（所有 depends_on 都为空列表多半是模型照格式填写，而不是真的相互独立；
+    忽略无法解析的依赖会让该步骤拿不到它需要的结果）。
+    """
+    if not any(step.get("depends_on") for step in steps):
+        return None
+
+    name_to_index = {}
+    for i, step in enumerate(steps):
+        name_to_index.setdefault(str(step.get("step_name")), i)
+
+    dependencies = []
+    for i, step in enumerate(steps):
+        declared = step.get("depends_on") or []
+        if not isinstance(declared, list):
+            declared = [declared]
+        resolved = []
+        for dep in declared:
+            index = _resolve_step(dep, name_to_index, len(steps))
+            if index is None or index == i:
+                print(f"警告: 步骤 '{step.get('step_name')}' 的依赖 '{dep}' 无效，改为按顺序执行")
+                return None
+            if index not in resolved:
+                resolved.append(index)
+        dependencies.append(resolved)
+
+    # 拓扑排序检查是否有环
+    remaining = [len(deps) for deps in dependencies]
+    dependents = [[] for _ in steps]
+    for i, deps in enumerate(dependencies):
+        for dep in deps:
+            dependents[dep].append(i)
+    ready = [i for i, count in enumerate(remaining) if count == 0]
+    visited = 0
+    while ready:
+        current = ready.pop()
+        visited += 1
+        for nxt in dependents[current]:
+            remaining[nxt] -= 1
+            if remaining[nxt] == 0:
+                ready.append(nxt)
+    if visited != len(steps):
+        print("警告: 步骤依赖中存在环，改为按顺序执行")
+        return None
+    return dependencies
+
+
+def run_dag(
+    dependencies: List[List[int]],
+    execute: Callable[[int, Dict[int, Any]], Any],
+    max_workers: int = 4
+) -> List[Any]:
+    """
+    按依赖关系并发执行步骤：依赖全部完成的步骤立即提交。execute(index, dep_results) 中
+    dep_results 为 {依赖步骤下标: 结果}。返回按步骤顺序排列的结果；任一步骤失败时不再提交新步骤，
+    等待正在执行的步骤结束后抛出该异常。
+    """
+    count = len(dependencies)
+    results: Dict[int, Any] = {}
+    remaining = [set(deps) for deps in dependencies]
+    submitted = set()
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        running = {}
+
+        def submit_ready():
+            for i in range(count):
+                if i not in submitted and not remaining[i]:
+                    submitted.add(i)
+                    dep_results = {dep: results[dep] for dep in dependencies[i]}
+                    running[executor.submit(execute, i, dep_results)] = i
+
+        submit_ready()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                for i in range(count):
+                    remaining[i].discard(index)
+            if error is None:
+                submit_ready()
+
+    if error is not None:
+        raise error
+    return [results[i] for i in range(count)]
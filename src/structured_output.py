@@ -0,0 +1,209 @@
+import ast
+import json
+import re
+from typing import List, Dict, Any, Optional, Sequence, Tuple
+
+# 服务商支持时使用的 JSON 模式（OpenAI 兼容接口的 response_format）；该模式要求顶层输出为对象
+JSON_MODE = {"type": "json_object"}
+
+_FENCE = re.compile(r"```[a-zA-Z]*")
+_TRAILING_COMMA = re.compile(r",(\s*[\]}])")
+# 字符串外的全角标点
+_FULLWIDTH = {"：": ":", "，": ",", "［": "[", "］": "]", "｛": "{", "｝": "}"}
+_STRUCTURAL = ",:]}，：］｝"
+_NEXT_CHAR = re.compile(r"\s*(\S)")
+
+
+def repair_json_text(text: str) -> str:
+    """
+    修复模型输出中常见的 JSON 缺陷：代码块标记、用中文引号“”作为字符串定界符、
+    字符串外的全角标点、列表或对象末尾多余的逗号。ASCII 引号内的中文引号属于内容，保持不变。
+    """
+    text = _FENCE.sub("", text)
+    out = []
+    closer = None  # 当前字符串的结束引号；None 表示不在字符串内
+    escape = False
+    for i, ch in enumerate(text):
+        if closer is None:
+            if ch == '"' or ch == "“" or ch == "”":
+                closer = '"' if ch == '"' else "”"
+                out.append('"')
+            else:
+                out.append(_FULLWIDTH.get(ch, ch))
+            continue
+        if escape:
+            escape = False
+            out.append(ch)
+        elif ch == "\\":
+            escape = True
+            out.append(ch)
+        elif ch == '"' and closer == '"':
+            closer = None
+            out.append('"')
+        elif closer == "”" and ch in "“”":
+            # 中文引号可能嵌套在内容里：后面紧跟结构字符时才视为字符串结束
+            following = _NEXT_CHAR.match(text, i + 1)
+            if following is None or following.group(1) in _STRUCTURAL:
+                closer = None
+                out.append('"')
+            else:
+                out.append(ch)
+        elif ch == '"':
+            out.append('\\"')  # 中文引号定界的字符串里出现的 ASCII 引号
+        else:
+            out.append(ch)
+    return _strip_trailing_commas("".join(out))
+
+
+def _strip_trailing_commas(text: str) -> str:
+    # 只处理字符串外的逗号：按 ASCII 引号切分，偶数段在字符串外
+    parts = re.split(r'("(?:\\.|[^"\\])*")', text)
+    for i in range(0, len(parts), 2):
+        parts[i] = _TRAILING_COMMA.sub(r"\1", parts[i])
+    return "".join(parts)
+
+
+def loads_lenient(text: str) -> Any:
+    """依次尝试标准 JSON、修复后的 JSON 和 Python 字面量（单引号），都失败时抛出 ValueError。"""
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    repaired = repair_json_text(text)
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return ast.literal_eval(repaired.strip())
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise ValueError("无法解析为 JSON") from None
+
+
+def _unwrap_items(value: Any) -> Optional[List[Any]]:
+    # JSON 模式下顶层是对象：取其中的列表字段，或把单个对象当作只有一项的列表
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        if len(value) == 1 and isinstance(next(iter(value.values())), list):
+            return next(iter(value.values()))
+        lists = [v for v in value.values() if isinstance(v, list) and v and all(isinstance(x, dict) for x in v)]
+        if len(lists) == 1:
+            return lists[0]
+        if not lists:
+            return [value]
+    return None
+
+
+def parse_json_array(text: str) -> Optional[List[Any]]:
+    """
+    从完整文本中取出 JSON 列表（第一个 '[' 到最后一个 ']'，或 JSON 模式下包着列表的对象），
+    必要时先修复常见缺陷。解析失败返回 None。
+    """
+    text = _FENCE.sub("", text)
+    candidates = []
+    for opener, closer in (("[", "]"), ("{", "}")):
+        start_index = text.find(opener)
+        end_index = text.rfind(closer) + 1
+        if start_index != -1 and end_index > start_index:
+            candidates.append((start_index, text[start_index:end_index]))
+    # 先尝试最早出现的定界符
+    for _, candidate in sorted(candidates):
+        try:
+            items = _unwrap_items(loads_lenient(candidate))
+        except ValueError:
+            continue
+        if items is not None:
+            return items
+    return None
+
+
+def validate_items(items: Sequence[Any], required_keys: Sequence[str]) -> Tuple[List[Dict[str, Any]], List[Any]]:
+    """
+    把列表元素分为 (有效, 无效)：有效元素是 required_keys 的值都为非空字符串的对象。
+    数字（例如 "step_name": 1）转换为字符串，其他类型视为无效。
+    """
+    valid, invalid = [], []
+    for item in items:
+        if not isinstance(item, dict):
+            invalid.append(item)
+            continue
+        item = dict(item)
+        for key in required_keys:
+            value = item.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                item[key] = value = str(value)
+            if not isinstance(value, str) or not value.strip():
+                break
+        else:
+            valid.append(item)
+            continue
+        invalid.append(item)
+    return valid, invalid
+
+
+class JsonArrayStream:
+    """
+    增量解析流式输出中的 JSON 列表：每喂入一段文本，返回其中新完成的顶层元素。
+    列表的 ']' 出现后 done 为 True，调用方可以不再等待剩余输出。元素按 loads_lenient 解析，
+    中文引号也视为字符串定界符，多余的逗号被忽略。
+    """
+    def __init__(self):
+        self.done = False
+        self.failed = False
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._closer = '"'
+        self._escape = False
+        self._element = []
+
+    def feed(self, text: str) -> List[Any]:
+        items = []
+        for ch in text:
+            if self.done or self.failed:
+                break
+            if not self._started:
+                if ch == '[':
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                self._element.append(ch)
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == self._closer or (self._closer == "”" and ch == "“"):
+                    self._in_string = False
+                continue
+
+            if ch in '"“”':
+                self._in_string = True
+                self._closer = '"' if ch == '"' else "”"
+            elif ch in '[{':
+                self._depth += 1
+            elif ch in ']}':
+                self._depth -= 1
+
+            if self._depth == 0:
+                # 顶层列表结束
+                self._finish_element(items)
+                self.done = True
+            elif self._depth == 1 and ch == ',':
+                self._finish_element(items)
+            else:
+                self._element.append(ch)
+        return items
+
+    def _finish_element(self, items: List[Any]) -> None:
+        raw = "".join(self._element).strip()
+        self._element = []
+        if not raw:
+            return
+        try:
+            items.append(loads_lenient(raw))
+        except ValueError:
+            # 第一个 '[' 可能并不是 JSON 的开头，交给调用方在完整输出上回退解析
+            self.failed = True
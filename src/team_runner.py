@@ -1,99 +1,276 @@
-from typing import List, Dict, Any, Tuple
-from agents_builder import BaseAgent, ChiefAgent, ManagerAgent, WorkerAgent, build_agent
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import List, Dict, Any, Tuple, Callable, Optional
+from agents_builder import AgentPool, BaseAgent, ChiefAgent, ManagerAgent, WorkerAgent
+from context_budget import StepContext, TokenLedger, count_tokens
+from llm_scheduler import LLMError
+from tracing import Tracer, Span
+from step_scheduler import resolve_dependencies, run_dag
+from prompt_templates import render_prompt
+
+# 流式回调：on_token(agent_name, chunk)
+TokenCallback = Callable[[str, str], None]
+
+def _agent_callback(on_token: Optional[TokenCallback], agent_name: str) -> Optional[Callable[[str], None]]:
+    return partial(on_token, agent_name) if on_token is not None else None
+
+def _record_calls(span: Span, agent: BaseAgent) -> None:
+    # 把 Agent 在该 span 内的 LLM 调用统计记入 span
+    for call in agent.pop_calls():
+        span.record_call(call)
+
+class _RunCancelled(Exception):
+    """运行已被取消（例如 Chief 分解失败），子树在下一次调用 LLM 之前停止。"""
+
+class _TeamRun:
+    """
+    一次 run_hierarchical_team 调用中各 Manager 子树共享的状态。
+    """
+    def __init__(
+        self,
+        initial_input: str,
+        manager_prototype_info: Dict[str, Any],
+        worker_prototype_info: Dict[str, Any],
+        config: Dict[str, Any],
+        tracer: Tracer,
+        on_token: Optional[TokenCallback],
+        pool: AgentPool
+    ):
+        self.initial_input = initial_input
+        self.manager_prototype_info = manager_prototype_info
+        self.worker_prototype_info = worker_prototype_info
+        self.config = config
+        self.context_config = config.get("context", {})
+        self.tracer = tracer
+        self.on_token = on_token
+        self.pool = pool
+        self.ledger = TokenLedger()
+        self._cancelled = threading.Event()
+
+    def cancel(self) -> None:
+        """让正在执行的 Manager 子树在下一次调用 LLM 之前停止，结果不再需要。"""
+        self._cancelled.set()
+
+    def _check_cancelled(self) -> None:
+        if self._cancelled.is_set():
+            raise _RunCancelled()
+
+    def run_manager(self, index: int, task: Dict[str, str], parent: Span) -> Tuple[List[str], str]:
+        """
+        执行单个子任务的Manager子树（分解步骤、Worker依次执行、Manager总结）。
+        返回该子树的推理过程和交给Chief的总结。LLM 调用失败时该子任务标记为失败，
+        错误信息不会作为结果传给后续的 Worker。
+        """
+        manager_reasoning = []
+        # 创建Manager Agent（从池中复用）
+        manager_agent = self.pool.acquire(self.manager_prototype_info, f"Manager_{task['task_name'].replace(' ', '_')}")
+        try:
+            with self.tracer.span("Manager", f"Manager_{task['task_name']}", "subtree", parent=parent) as subtree_span:
+                manager_output = self._execute_manager(manager_agent, manager_reasoning, index, task, subtree_span)
+        except LLMError as e:
+            print(f"  子任务 '{task['task_name']}' 失败: {type(e).__name__}: {e}")
+            manager_reasoning.append(f"子任务 '{task['task_name']}' 失败: {type(e).__name__}: {e}")
+            manager_output = f"子任务 '{task['task_name']}' 执行失败，没有可用的结果。"
+        finally:
+            self.pool.release(manager_agent)
+        return manager_reasoning, manager_output
+
+    def _new_step_context(self) -> StepContext:
+        return StepContext(
+            self.initial_input,
+            keep_recent=self.context_config.get("keep_recent", 2),
+            compress_tokens=self.context_config.get("compress_tokens", 200),
+            ledger=self.ledger
+        )
+
+    def _manager_summary_prompt(self, manager_agent: ManagerAgent, task: Dict[str, str], step_context: StepContext) -> str:
+        # manager_budget 约束实际发送的整个汇总请求（不带记忆）：系统提示和模板文字从预算中扣除
+        fields = {"task_name": task['task_name'], "task_description": task['task_description']}
+        budget = self.context_config.get('manager_budget')
+        if budget is not None:
+            budget -= count_tokens(manager_agent.system_prompt) + count_tokens(render_prompt("manager.summarize", context="", **fields))
+        return render_prompt("manager.summarize", context=step_context.render(budget), **fields)
+
+    @staticmethod
+    def _worker_name(task: Dict[str, str], step: Dict[str, Any]) -> str:
+        return f"Worker_{task['task_name'].replace(' ', '_')}_{step['step_name'].replace(' ', '_')}"
+
+    def _run_worker(self, task: Dict[str, str], index: int, step: Dict[str, Any], context: str, subtree_span: Span) -> str:
+        """创建Worker执行一个步骤，返回其输出。"""
+        self._check_cancelled()
+        print(f"    Worker {index+1}: 执行步骤 '{step['step_name']}'")
+
+        # 创建Worker Agent（从池中复用），执行步骤
+        with self.pool.lease(self.worker_prototype_info, self._worker_name(task, step)) as worker_agent:
+            with self.tracer.span("Worker", worker_agent.name, "execute", parent=subtree_span) as span:
+                try:
+                    worker_result = worker_agent.execute_step(
+                        step['step_instruction'],
+                        context,
+                        on_token=_agent_callback(self.on_token, worker_agent.name)
+                    )
+                finally:
+                    _record_calls(span, worker_agent)
+        print(f"      输出: {worker_result[:100]}...")  # 打印部分结果
+        self.tracer.event("worker_finished", span, task=task['task_name'], step=step['step_name'])
+        return worker_result
+
+    def _execute_manager(self, manager_agent: ManagerAgent, manager_reasoning: List[str], index: int, task: Dict[str, str], subtree_span: Span) -> str:
+        tracer = self.tracer
+        self._check_cancelled()
+        print(f"\nManager {index+1}: 处理子任务 '{task['task_name']}'")
+
+        # 3. Manager分解子任务
+        sub_task_description = render_prompt("manager.sub_task", initial_input=self.initial_input, task_description=task['task_description'])
+        with tracer.span("Manager", manager_agent.name, "decompose", parent=subtree_span) as span:
+            try:
+                if self.on_token is None:
+                    steps = manager_agent.decompose_sub_task(sub_task_description)
+                else:
+                    steps = list(manager_agent.decompose_sub_task_stream(sub_task_description, on_token=_agent_callback(self.on_token, manager_agent.name)))
+            finally:
+                _record_calls(span, manager_agent)
+        manager_output = f"子任务 '{task['task_name']}' 已分解为 {len(steps)} 个步骤: {[step['step_name'] for step in steps]}"
+        print(f"  {manager_agent.name}: {manager_output}")
+        manager_reasoning.append(f"{manager_agent.name}: {manager_output}")
+        tracer.event("manager_decomposed", span, task=task['task_name'], steps=[step['step_name'] for step in steps])
+
+        if not steps:
+            return f"子任务 '{task['task_name']}' 的结果: Manager未能分解步骤。"
+
+        # 4. 为每个步骤创建Worker并执行
+        # 初始上下文是原始输入；之前步骤的结果按 token 预算组装，避免提示词随步骤数二次增长
+        dependencies = resolve_dependencies(steps)
+        if dependencies is None:
+            # 没有声明依赖：按顺序执行，每个Worker看到之前所有步骤的结果
+            step_context = self._new_step_context()
+            for j, step in enumerate(steps):
+                worker_result = self._run_worker(task, j, step, step_context.render(self.context_config.get("worker_budget")), subtree_span)
+                manager_reasoning.append(f"      {self._worker_name(task, step)}: {worker_result}")
+
+                # 更新上下文，为下一个worker提供信息
+                step_context.add(step['step_name'], worker_result)
+        else:
+            # 声明了依赖：相互独立的步骤并发执行，每个Worker只看到其依赖步骤的结果
+            def execute(j: int, dep_results: Dict[int, str]) -> str:
+                dep_context = self._new_step_context()
+                for dep in dependencies[j]:
+                    dep_context.add(steps[dep]['step_name'], dep_results[dep])
+                return self._run_worker(task, j, steps[j], dep_context.render(self.context_config.get("worker_budget")), subtree_span)
+
+            worker_outputs = run_dag(dependencies, execute, self.config["LLM"].get("max_step_concurrency", 4))
+            step_context = self._new_step_context()
+            for step, worker_result in zip(steps, worker_outputs):
+                manager_reasoning.append(f"      {self._worker_name(task, step)}: {worker_result}")
+                step_context.add(step['step_name'], worker_result)
+
+        # Manager汇总Worker的结果
+        # 上下文已包含原始输入，不再附带记忆中的分解轮次（其中也有原始输入）
+        self._check_cancelled()
+        manager_summary_prompt = self._manager_summary_prompt(manager_agent, task, step_context)
+        with tracer.span("Manager", manager_agent.name, "summarize", parent=subtree_span) as span:
+            try:
+                manager_final_output = manager_agent.think(manager_summary_prompt, on_token=_agent_callback(self.on_token, manager_agent.name), use_memory=False)
+            finally:
+                _record_calls(span, manager_agent)
+        print(f"  {manager_agent.name} 总结: {manager_final_output[:100]}...")
+        manager_reasoning.append(f"{manager_agent.name} 总结: {manager_final_output}")
+        return f"子任务 '{task['task_name']}' 的总结:\n{manager_final_output}"
 
 def run_hierarchical_team(
     initial_input: str,
     chief_agent: ChiefAgent,
     manager_prototype_info: Dict[str, Any],
     worker_prototype_info: Dict[str, Any],
-    config: Dict[str, Any]
+    config: Dict[str, Any],
+    on_token: Optional[TokenCallback] = None,
+    tracer: Optional[Tracer] = None,
+    agent_pool: Optional[AgentPool] = None
 ) -> Tuple[List[str], str]:
     """
     运行三层架构的智能体团队。
     1. Chief Agent 分解任务。
-    2. 为每个子任务创建一个 Manager Agent。
+    2. 为每个子任务创建一个 Manager Agent（可按 config["LLM"]["max_concurrency"] 并行执行）。
     3. 每个 Manager Agent 分解其子任务为具体步骤。
-    4. 为每个步骤创建一个 Worker Agent 来执行。
+    4. 为每个步骤创建一个 Worker Agent 来执行（步骤声明了 depends_on 时按依赖关系并发执行）。
     5. 结果逐层返回，最终由 Chief Agent 汇总。
+    传入 on_token(agent_name, chunk) 时所有 Agent 以流式方式输出，每收到一段文本就回调一次
+    （Manager 并行时会从多个线程回调）。传入 tracer 时每次 Agent 调用都会记录为一个 span。
+    Manager 和 Worker 从 agent_pool 中复用；批处理时传入同一个池，可在多个患者之间复用。
     """
+    if tracer is None:
+        tracer = Tracer("run")
+    if agent_pool is None:
+        agent_pool = AgentPool(config)
+    run = _TeamRun(initial_input, manager_prototype_info, worker_prototype_info, config, tracer, on_token, agent_pool)
     reasoning_process = []
-    separator = "----------------------------------------------------------------------------------------------------\n----------------------------------------------------------------------------------------------------"  # 大量分隔符用于划分每个Agent的输出，两行
     print("--- Chief Agent 开始工作 ---")
-    
-    # 1. Chief分解任务
-    reasoning_process.append(separator)  # 添加分隔符
-    sub_tasks = chief_agent.decompose_task(initial_input)
-    chief_output = f"主任务已分解为 {len(sub_tasks)} 个子任务: {[task['task_name'] for task in sub_tasks]}"
-    print(f"Chief: {chief_output}")
-    reasoning_process.append(f"Chief: {chief_output}")
-
-    if not sub_tasks:
-        final_summary = "Chief未能成功分解任务，流程终止。"
-        reasoning_process.append(final_summary)
-        return reasoning_process, final_summary
-
-    # 2. 为每个子任务创建Manager并执行
-    manager_outputs = []
-    for i, task in enumerate(sub_tasks):
-        reasoning_process.append(separator)  # 添加分隔符
-        print(f"\nManager {i+1}: 处理子任务 '{task['task_name']}'")
-        
-        # 创建Manager Agent
-        manager_info = manager_prototype_info.copy()
-        manager_info["name"] = f"Manager_{task['task_name'].replace(' ', '_')}"
-        manager_agent = build_agent(config, manager_info)
-        
-        # 3. Manager分解子任务
-        steps = manager_agent.decompose_sub_task(f"原始数据和问题:\n{initial_input}\n\n子任务目标: {task['task_description']}")
-        manager_output = f"子任务 '{task['task_name']}' 已分解为 {len(steps)} 个步骤: {[step['step_name'] for step in steps]}"
-        print(f"  {manager_agent.name}: {manager_output}")
-        reasoning_process.append(f"{manager_agent.name}: {manager_output}")
 
-        if not steps:
-            manager_outputs.append(f"子任务 '{task['task_name']}' 的结果: Manager未能分解步骤。")
-            continue
+    with tracer.span("Run", chief_agent.name, "run") as run_span:
+        # 1. Chief分解任务
+        # 2. 为每个子任务创建Manager并执行
+        # 各Manager只依赖 initial_input 和自己的子任务描述，因此可以并行执行；
+        # 流式模式下Chief每生成一个子任务就立即提交，不必等待整个分解完成。
+        # 结果按子任务顺序收集，保证推理过程和最终汇总的顺序是确定的
+        max_concurrency = max(1, int(config["LLM"].get("max_concurrency", 1)))
+        sub_tasks = []
+        futures = []
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            with tracer.span("Chief", chief_agent.name, "decompose", parent=run_span) as chief_span:
+                try:
+                    if on_token is None:
+                        task_source = chief_agent.decompose_task(initial_input)
+                    else:
+                        task_source = chief_agent.decompose_task_stream(initial_input, on_token=_agent_callback(on_token, chief_agent.name))
+                    for task in task_source:
+                        print(f"Chief: 已生成子任务 '{task['task_name']}'")
+                        futures.append(executor.submit(run.run_manager, len(sub_tasks), task, run_span))
+                        sub_tasks.append(task)
+                finally:
+                    _record_calls(chief_span, chief_agent)
+            manager_results = [future.result() for future in futures]
+        except BaseException:
+            # Chief 分解失败（或被中断）时结果不再需要：取消尚未开始的子树，
+            # 正在执行的子树在下一次调用 LLM 之前停止，不再消耗配额
+            run.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
 
-        # 4. 为每个步骤创建Worker并执行
-        worker_outputs = []
-        step_context = initial_input # 初始上下文是原始输入
-        for j, step in enumerate(steps):
-            reasoning_process.append(separator)  # 添加分隔符
-            print(f"    Worker {j+1}: 执行步骤 '{step['step_name']}'")
-            
-            # 创建Worker Agent
-            worker_info = worker_prototype_info.copy()
-            worker_info["name"] = f"Worker_{task['task_name'].replace(' ', '_')}_{step['step_name'].replace(' ', '_')}"
-            worker_agent = build_agent(config, worker_info)
-            
-            # Worker执行步骤
-            worker_result = worker_agent.execute_step(step['step_instruction'], step_context)
-            print(f"      输出: {worker_result[:100]}...")  # 打印部分结果
-            reasoning_process.append(f"      {worker_agent.name}: {worker_result}")
-            worker_outputs.append(worker_result)
-            
-            # 更新上下文，为下一个worker提供信息
-            step_context += f"\n\n步骤 '{step['step_name']}' 的已完成结果:\n{worker_result}"
-
-            reasoning_process.append(separator)  # 在Workers之间添加分隔符
+        chief_output = f"主任务已分解为 {len(sub_tasks)} 个子任务: {[task['task_name'] for task in sub_tasks]}"
+        print(f"Chief: {chief_output}")
+        reasoning_process.append(f"Chief: {chief_output}")
+        tracer.event("chief_decomposed", chief_span, tasks=[task['task_name'] for task in sub_tasks])
+
+        if not sub_tasks:
+            final_summary = "Chief未能成功分解任务，流程终止。"
+            reasoning_process.append(final_summary)
+            return reasoning_process, final_summary
+
+        manager_outputs = []
+        for manager_reasoning, manager_output in manager_results:
+            reasoning_process.extend(manager_reasoning)
+            manager_outputs.append(manager_output)
+
+        # 5. Chief汇总所有Manager的结果
+        # 汇总提示已包含原始输入，不再附带记忆中的分解轮次，原始输入只发送一次
+        print("\nChief: 开始最终汇总")
+        all_manager_summaries = "\n\n".join(manager_outputs)
+        final_summary_prompt = render_prompt("chief.summarize", initial_input=initial_input, summaries=all_manager_summaries)
+        with tracer.span("Chief", chief_agent.name, "summarize", parent=run_span) as span:
+            try:
+                final_result = chief_agent.think(final_summary_prompt, on_token=_agent_callback(on_token, chief_agent.name), use_memory=False)
+            finally:
+                _record_calls(span, chief_agent)
+
+        print(f"最终结果: {final_result[:200]}...")  # 打印部分最终结果
+        reasoning_process.append(f"Chief 最终总结: {final_result}")
+        print(run.ledger.summary())
+        reasoning_process.append(run.ledger.summary())
+        tracer.event("context_tokens", run_span, naive=run.ledger.naive, sent=run.ledger.sent, saved=run.ledger.saved)
 
-        # Manager汇总Worker的结果
-        reasoning_process.append(separator)  # 添加分隔符
-        manager_summary_prompt = f"你已完成子任务 '{task['task_name']}'。请根据以下所有工作步骤的结果，对该子任务进行总结。\n\n上下文:\n{step_context}"
-        manager_final_output = manager_agent.think(manager_summary_prompt)
-        print(f"  {manager_agent.name} 总结: {manager_final_output[:100]}...")
-        reasoning_process.append(f"{manager_agent.name} 总结: {manager_final_output}")
-        manager_outputs.append(f"子任务 '{task['task_name']}' 的总结:\n{manager_final_output}")
-
-    # 5. Chief汇总所有Manager的结果
-    reasoning_process.append(separator)  # 添加分隔符
-    print("\nChief: 开始最终汇总")
-    all_manager_summaries = "\n\n".join(manager_outputs)
-    final_summary_prompt = f"所有子任务已完成。请根据以下各子任务的总结，结合原始请求，生成最终的、完整的报告。\n\n原始请求:\n{initial_input}\n\n各子任务总结:\n{all_manager_summaries}"
-    final_result = chief_agent.think(final_summary_prompt)
-    
-    print(f"最终结果: {final_result[:200]}...")  # 打印部分最终结果
-    reasoning_process.append(f"Chief 最终总结: {final_result}")
-    
     return reasoning_process, final_result
 
 def run_multiagent_team(patient_data: Dict[str, Any], team: List[BaseAgent]):
@@ -101,4 +278,4 @@ def run_multiagent_team(patient_data: Dict[str, Any], team: List[BaseAgent]):
     # 但在新的三层架构中，我们将使用 run_hierarchical_team
     print("警告: run_multiagent_team 已被调用，但推荐使用 run_hierarchical_team。")
     # ... (原有代码可以保留或移除)
-    return ["旧流程已停用"], "请更新到 run_hierarchical_team"
\ No newline at end of file
+    return ["旧流程已停用"], "请更新到 run_hierarchical_team"
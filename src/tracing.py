@@ -0,0 +1,163 @@
+import csv
+import itertools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterator, Optional
+
+
+class Span:
+    """
+    一次 Agent 调用（或一组调用）的结构化记录：耗时、排队时间、token 用量、缓存命中和重试次数。
+    """
+    def __init__(self, span_id: int, parent_id: Optional[int], kind: str, name: str, operation: str):
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.kind = kind  # Run / Chief / Manager / Worker
+        self.name = name
+        self.operation = operation  # decompose / execute / summarize / subtree ...
+        self.start = time.time()
+        self.wall_time = 0.0
+        self.queue_time = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cache_hit = False
+        self.retries = 0
+        self.status = "ok"
+        self.error = None
+
+    def record_call(self, call: Optional[Dict[str, Any]]) -> None:
+        """累加一次 LLM 调用的统计（agent.pop_calls() 返回的元素）。"""
+        if not call:
+            return
+        self.prompt_tokens += call.get("prompt_tokens") or 0
+        self.completion_tokens += call.get("completion_tokens") or 0
+        self.queue_time += call.get("queue_time") or 0.0
+        self.retries += call.get("retries") or 0
+        self.cache_hit = self.cache_hit or bool(call.get("cache_hit"))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+class Tracer:
+    """
+    单次运行（一个影像号）的追踪：收集所有 span 和结构化事件，可导出为 JSON 文件。线程安全。
+    """
+    def __init__(self, trace_id: str):
+        self.trace_id = str(trace_id)
+        self.started = time.time()
+        self.spans: List[Span] = []
+        self.events: List[Dict[str, Any]] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, kind: str, name: str, operation: str, parent: Optional[Span] = None) -> Iterator[Span]:
+        with self._lock:
+            span = Span(next(self._ids), parent.span_id if parent else None, kind, name, operation)
+            self.spans.append(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.status = "error"
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.wall_time = time.perf_counter() - started
+
+    def event(self, name: str, span: Optional[Span] = None, **fields: Any) -> None:
+        """记录一个结构化事件（替代推理过程中的分隔符文本）。"""
+        with self._lock:
+            self.events.append({
+                "time": time.time(),
+                "name": name,
+                "span_id": span.span_id if span else None,
+                **fields
+            })
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "trace_id": self.trace_id,
+                "started": self.started,
+                "spans": [s.to_dict() for s in self.spans],
+                "events": list(self.events)
+            }
+
+    def export_json(self, path: str) -> None:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+class MetricsAggregator:
+    """
+    汇总批处理中多次运行的 span，导出为 CSV（每个 span 一行）或 Prometheus 文本格式（按 Agent 类型聚合）。
+    """
+    def __init__(self):
+        self.rows: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, tracer: Tracer) -> None:
+        trace = tracer.to_dict()
+        with self._lock:
+            for span in trace["spans"]:
+                self.rows.append({"trace_id": trace["trace_id"], **span})
+
+    def write_csv(self, path: str) -> None:
+        columns = ["trace_id", "span_id", "parent_id", "kind", "name", "operation", "start", "wall_time",
+                   "queue_time", "prompt_tokens", "completion_tokens", "cache_hit", "retries", "status", "error"]
+        with self._lock:
+            rows = list(self.rows)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+    def write_prometheus(self, path: str) -> None:
+        totals: Dict[str, Dict[str, float]] = {}
+        with self._lock:
+            for row in self.rows:
+                t = totals.setdefault(row["kind"], {
+                    "spans": 0, "errors": 0, "wall": 0.0, "queue": 0.0,
+                    "prompt": 0, "completion": 0, "cache_hits": 0, "retries": 0
+                })
+                t["spans"] += 1
+                t["errors"] += row["status"] != "ok"
+                t["wall"] += row["wall_time"]
+                t["queue"] += row["queue_time"]
+                t["prompt"] += row["prompt_tokens"]
+                t["completion"] += row["completion_tokens"]
+                t["cache_hits"] += bool(row["cache_hit"])
+                t["retries"] += row["retries"]
+
+        metrics = [
+            ("dhelper_spans_total", "counter", "spans", "Number of agent spans"),
+            ("dhelper_span_errors_total", "counter", "errors", "Number of failed agent spans"),
+            ("dhelper_span_wall_seconds_total", "counter", "wall", "Total wall time of agent spans"),
+            ("dhelper_span_queue_seconds_total", "counter", "queue", "Total time spent waiting for rate limits"),
+            ("dhelper_prompt_tokens_total", "counter", "prompt", "Prompt tokens"),
+            ("dhelper_completion_tokens_total", "counter", "completion", "Completion tokens"),
+            ("dhelper_cache_hits_total", "counter", "cache_hits", "Spans served from the response cache"),
+            ("dhelper_retries_total", "counter", "retries", "LLM call retries"),
+        ]
+        lines = []
+        for metric, metric_type, key, help_text in metrics:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            for kind, t in sorted(totals.items()):
+                lines.append(f'{metric}{{kind="{kind}"}} {t[key]}')
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")